@@ -1,18 +1,37 @@
 import os
+import stat
 import json
+import uuid
+import queue
+import hmac
+import math
+import fcntl
+import time
+import atexit
+import decimal
+import hashlib
 import logging
+import threading
+from abc import ABC, abstractmethod
+from collections import deque
 from datetime import datetime, timedelta
+from logging.handlers import QueueHandler, QueueListener
 from typing import Dict, List, Optional
 
-from flask import Flask, request, jsonify, render_template, redirect, url_for
+import orjson
+from flask import Flask, request, jsonify, render_template, redirect, url_for, g
+from flask.json.provider import JSONProvider
 from flask_cors import CORS
 from supabase import create_client, Client
+from supabase.lib.client_options import ClientOptions
 from dotenv import load_dotenv
+from cachetools import TTLCache
 
 # Import our ML models
 from ml_models.sms_parser import MoMoSMSParser
-from ml_models.fraud_detector import FraudDetector
-from ml_models.matcher import TxIDMatcher
+from ml_models.fraud_detector import FraudDetector, TransactionHistory
+from ml_models.matcher import TxIDMatcher, TransactionIndex
+from ml_models.timestamps import epoch_seconds
 
 # Load environment variables
 load_dotenv()
@@ -24,22 +43,92 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+class _DeferredQueueHandler(QueueHandler):
+    """Queue handler that leaves formatting to the listener thread."""
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # The stock prepare() formats on the calling thread to make the record picklable;
+        # this queue never leaves the process, so the record is passed on as is
+        return record
+
+# Request threads only enqueue records; a listener thread does the formatting and I/O
+_root_logger = logging.getLogger()
+_log_handlers = list(_root_logger.handlers)
+_log_queue_handler = _DeferredQueueHandler(queue.Queue(-1))
+_root_logger.handlers = [_log_queue_handler]
+_log_listener: Optional[QueueListener] = None
+
+def start_log_listener():
+    """Start the background log writer for this process."""
+    global _log_listener
+    
+    # Threads don't survive fork, so each gunicorn worker starts its own listener on a fresh queue
+    _log_queue_handler.queue = queue.Queue(-1)
+    _log_listener = QueueListener(_log_queue_handler.queue, *_log_handlers, respect_handler_level=True)
+    _log_listener.start()
+
+@atexit.register
+def stop_log_listener():
+    """Flush queued log records before the process exits."""
+    global _log_listener
+    
+    if _log_listener:
+        _log_listener.stop()
+        _log_listener = None
+
+start_log_listener()
+
+class OrjsonProvider(JSONProvider):
+    """Flask JSON provider backed by orjson for faster response encoding."""
+    
+    @staticmethod
+    def _default(obj):
+        """Serialize the types orjson leaves to the caller, as Flask's default provider does."""
+        if isinstance(obj, decimal.Decimal):
+            return str(obj)
+        if hasattr(obj, '__html__'):
+            return str(obj.__html__())
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+    
+    def dumps(self, obj, **kwargs) -> str:
+        return orjson.dumps(obj, default=self._default, option=orjson.OPT_NON_STR_KEYS).decode()
+    
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 # Initialize Flask app
 app = Flask(__name__)
+app.json = OrjsonProvider(app)
 app.config['SECRET_KEY'] = os.getenv('FLASK_SECRET_KEY', 'dev-secret-key-change-in-production')
 CORS(app)  # Enable CORS for all routes
 
 # Initialize Supabase client
 supabase_url = os.getenv('SUPABASE_URL')
 supabase_key = os.getenv('SUPABASE_ANON_KEY')
+SUPABASE_TIMEOUT = int(os.getenv('SUPABASE_TIMEOUT', 10))
+supabase: Optional[Client] = None
 
-if not supabase_url or not supabase_key:
-    logger.error("Supabase credentials not found. Please check your .env file.")
-    supabase = None
-else:
-    supabase: Client = create_client(supabase_url, supabase_key)
+def init_supabase() -> None:
+    """Create this process's Supabase client.
+    
+    Under gunicorn this is called again from post_fork so every worker owns
+    its connection pool instead of inheriting one from the preloading master.
+    """
+    global supabase
+    
+    if not supabase_url or not supabase_key:
+        logger.error("Supabase credentials not found. Please check your .env file.")
+        supabase = None
+        return
+    
+    supabase = create_client(
+        supabase_url, supabase_key,
+        options=ClientOptions(postgrest_client_timeout=SUPABASE_TIMEOUT)
+    )
     logger.info("Supabase client initialized successfully")
 
+init_supabase()
+
 # Initialize ML models
 sms_parser = MoMoSMSParser()
 fraud_detector = FraudDetector()
@@ -47,6 +136,44 @@ txid_matcher = TxIDMatcher()
 
 # Default verification code
 DEFAULT_VERIFICATION_CODE = '1043577'
+_VERIFICATION_CODE_BYTES = DEFAULT_VERIFICATION_CODE.encode()
+
+# Longest TxID accepted for verification (transactions.tx_id is VARCHAR(50))
+MAX_TXID_LENGTH = 50
+
+# Longest SMS accepted for processing (multi-part MoMo messages stay well under this)
+MAX_SMS_LENGTH = 2000
+
+# Number of stored TxIDs tracked by the duplicate-SMS Bloom filter
+SEEN_TXID_CAPACITY = 100_000
+
+# Rows per request when seeding it (PostgREST caps responses at max-rows, 1000 by default)
+STORED_TXID_PAGE_SIZE = 1000
+
+# Recent transactions are cached briefly so bursts of SMS share one fetch
+RECENT_CACHE_TTL = int(os.getenv('RECENT_CACHE_TTL', 30))
+FRAUD_HISTORY_COLUMNS = 'id,tx_id,amount,timestamp,sender_phone'
+RECENT_LISTING_COLUMNS = 'id,tx_id,amount,message_type,timestamp'
+_recent_cache = TTLCache(maxsize=8, ttl=RECENT_CACHE_TTL)
+_recent_cache_lock = threading.Lock()
+_recent_cache_version = 0  # bumped on every write so fetches racing a write aren't cached
+_recent_fetch_locks: Dict[tuple, threading.Lock] = {}
+RECENT_FETCH_LOCKS_MAX = 64
+
+# Gunicorn workers share transaction window snapshots through tmpfs, in a directory
+# only the service user may write to so nobody else can plant rows for /api/verify
+SNAPSHOT_DIR = os.path.join(os.getenv('SNAPSHOT_DIR', '/dev/shm'), f'momo-snapshots-{os.getuid()}')
+
+# Aggregated /api/stats results are computed server-side and cached briefly
+STATS_CACHE_TTL = int(os.getenv('STATS_CACHE_TTL', 30))
+_stats_cache = TTLCache(maxsize=1, ttl=STATS_CACHE_TTL)
+_stats_cache_lock = threading.Lock()
+
+# SMS rows are written by a background worker so /api/sms/process returns immediately
+INGEST_BATCH_SIZE = 50
+ingest_queue: queue.Queue = queue.Queue(maxsize=10_000)
+_ingest_worker: Optional[threading.Thread] = None
+_ingest_worker_lock = threading.Lock()
 
 class DatabaseManager:
     """Handles database operations with Supabase."""
@@ -64,16 +191,126 @@ class DatabaseManager:
             
             if response.data:
                 transaction_id = response.data[0]['id']
-                logger.info(f"Transaction stored successfully: {transaction_id}")
+                logger.info("Transaction stored successfully: %s", transaction_id)
+                DatabaseManager.invalidate_recent(response.data[0])
                 return transaction_id
             else:
-                logger.error(f"Failed to store transaction: {response}")
+                logger.error("Failed to store transaction: %s", response)
                 return None
                 
         except Exception as e:
-            logger.error(f"Error storing transaction: {str(e)}")
+            logger.error("Error storing transaction: %s", e)
+            return None
+    
+    @staticmethod
+    def ingest_sms(transaction_data: Dict, alerts_data: List[Dict], log_data: Dict) -> Optional[str]:
+        """Store a parsed SMS with its fraud alerts and processing log in one round-trip.
+        
+        Uses the ingest_sms RPC and falls back to individual inserts if it fails.
+        """
+        if not supabase:
+            logger.error("Supabase client not available")
+            return None
+        
+        payload = {
+            'transaction': transaction_data,
+            'fraud_alerts': alerts_data,
+            'log': log_data
+        }
+        
+        try:
+            response = supabase.rpc('ingest_sms', {'payload': payload}).execute()
+        except Exception as e:
+            logger.error("Error ingesting SMS via RPC, falling back to individual inserts: %s", e)
+            return DatabaseManager._ingest_sms_individually(transaction_data, alerts_data, log_data)
+        
+        if response.data:
+            transaction_id = response.data
+            logger.info("SMS ingested successfully: %s", transaction_id)
+            DatabaseManager.invalidate_recent({**transaction_data, 'id': transaction_id})
+            return transaction_id
+        else:
+            logger.error("Failed to ingest SMS: %s", response)
             return None
     
+    @staticmethod
+    def _ingest_sms_individually(transaction_data: Dict, alerts_data: List[Dict], 
+                                 log_data: Dict) -> Optional[str]:
+        """Legacy ingest path issuing one insert per row."""
+        transaction_id = DatabaseManager.store_transaction(transaction_data)
+        
+        DatabaseManager.store_fraud_alerts([
+            {**alert_data, 'transaction_id': transaction_id} for alert_data in alerts_data
+        ])
+        
+        DatabaseManager.log_sms_processing({**log_data, 'transaction_id': transaction_id})
+        return transaction_id
+    
+    @staticmethod
+    def ingest_batch(payloads: List[Dict]) -> List[Dict]:
+        """Store queued SMS payloads and verification attempts with one bulk insert per table.
+        
+        Tables are written in foreign-key order so rows queued later (e.g. a
+        verification of a just-forwarded SMS) land after what they reference.
+        Returns the transactions that were stored.
+        """
+        if not supabase:
+            logger.error("Supabase client not available")
+            return []
+        
+        transactions = [payload['transaction'] for payload in payloads if payload.get('transaction')]
+        stored_transactions = DatabaseManager._insert_rows('transactions', transactions)
+        stored_ids = {transaction['id'] for transaction in stored_transactions}
+        for transaction in stored_transactions:
+            DatabaseManager.invalidate_recent(transaction)
+        
+        alerts = []
+        logs = []
+        verifications = []
+        for payload in payloads:
+            if payload.get('verification'):
+                verifications.append(payload['verification'])
+                continue
+            
+            transaction = payload.get('transaction')
+            if transaction:
+                transaction_id = transaction['id'] if transaction['id'] in stored_ids else None
+            else:
+                transaction_id = payload.get('transaction_id')
+            alerts.extend({**alert, 'transaction_id': transaction_id} for alert in payload['fraud_alerts'])
+            # PostgREST rejects bulk inserts whose rows don't all have the same keys
+            logs.append({'error_message': None, **payload['log'], 'transaction_id': transaction_id})
+        
+        stored_alerts = DatabaseManager._insert_rows('fraud_alerts', alerts)
+        stored_logs = DatabaseManager._insert_rows('sms_processing_logs', logs)
+        logger.info("Stored SMS batch: %s transactions, %s alerts, %s logs",
+                    len(stored_transactions), len(stored_alerts), len(stored_logs))
+        
+        DatabaseManager._insert_rows('payment_verifications', verifications)
+        return stored_transactions
+    
+    @staticmethod
+    def _insert_rows(table: str, rows: List[Dict]) -> List[Dict]:
+        """Insert rows with one request, retrying them one by one if it fails; returns the rows stored."""
+        if not rows:
+            return []
+        
+        try:
+            supabase.table(table).insert(rows).execute()
+            return rows
+        except Exception as e:
+            # A single bad row (e.g. a duplicate TxID) fails the whole bulk insert
+            logger.error("Error storing %s batch, retrying individually: %s", table, e)
+        
+        stored = []
+        for row in rows:
+            try:
+                supabase.table(table).insert(row).execute()
+                stored.append(row)
+            except Exception as row_error:
+                logger.error("Error storing %s row: %s", table, row_error)
+        return stored
+    
     @staticmethod
     def get_transactions_by_txid(tx_id: str) -> List[Dict]:
         """Get transactions by TxID."""
@@ -84,26 +321,146 @@ class DatabaseManager:
             response = supabase.table('transactions').select('*').eq('tx_id', tx_id).execute()
             return response.data if response.data else []
         except Exception as e:
-            logger.error(f"Error fetching transactions by TxID: {str(e)}")
+            logger.error("Error fetching transactions by TxID: %s", e)
             return []
     
     @staticmethod
-    def get_recent_transactions(hours: int = 24) -> List[Dict]:
-        """Get recent transactions."""
+    def get_stored_txids(limit: int) -> Optional[List[str]]:
+        """Get the most recently stored TxIDs page by page, returning None on error."""
+        if not supabase:
+            return None
+        
+        tx_ids = []
+        try:
+            while len(tx_ids) < limit:
+                start = len(tx_ids)
+                end = min(start + STORED_TXID_PAGE_SIZE, limit) - 1
+                response = (supabase.table('transactions')
+                           .select('tx_id')
+                           .order('created_at', desc=True)
+                           .range(start, end)
+                           .execute())
+                rows = response.data or []
+                tx_ids.extend(row['tx_id'] for row in rows)
+                # The server may cap pages below the requested size, so only an empty page ends the scan
+                if not rows:
+                    break
+        except Exception as e:
+            logger.error("Error fetching stored TxIDs: %s", e)
+            return None
+        return tx_ids
+    
+    @staticmethod
+    def _recent_fetch_lock(key: tuple) -> threading.Lock:
+        """Get the lock serializing fetches of one recent-transactions window."""
+        with _recent_cache_lock:
+            lock = _recent_fetch_locks.get(key)
+            if lock is None:
+                if len(_recent_fetch_locks) >= RECENT_FETCH_LOCKS_MAX:
+                    # Keys come from request parameters, so drop idle locks instead of growing
+                    for idle_key in [k for k, l in _recent_fetch_locks.items() if not l.locked()]:
+                        del _recent_fetch_locks[idle_key]
+                lock = _recent_fetch_locks[key] = threading.Lock()
+            return lock
+    
+    @staticmethod
+    def get_recent_transactions(hours: int = 24, columns: str = '*', 
+                                limit: Optional[int] = None) -> List[Dict]:
+        """Get recent transactions, served from a short-lived cache."""
         if not supabase:
             return []
         
+        key = (hours, columns, limit)
+        # Held across the fetch so concurrent misses on the same window share a single
+        # round-trip, without making other windows wait behind it
+        with DatabaseManager._recent_fetch_lock(key):
+            with _recent_cache_lock:
+                cached = _recent_cache.get(key)
+                version = _recent_cache_version
+            if cached is not None:
+                return cached
+            
+            transactions = DatabaseManager.fetch_recent_transactions(hours, columns, limit)
+            if transactions is None:
+                return []
+            
+            with _recent_cache_lock:
+                # A row written mid-fetch may be missing from the result, so leave it uncached
+                if version == _recent_cache_version:
+                    _recent_cache[key] = transactions
+            return transactions
+    
+    @staticmethod
+    def fetch_recent_transactions(hours: int = 24, columns: str = '*', 
+                                  limit: Optional[int] = None) -> Optional[List[Dict]]:
+        """Fetch recent transactions straight from the database, returning None on error."""
+        if not supabase:
+            return None
+        
         try:
             cutoff_time = datetime.now() - timedelta(hours=hours)
-            response = (supabase.table('transactions')
-                       .select('*')
-                       .gte('timestamp', cutoff_time.isoformat())
-                       .order('timestamp', desc=True)
-                       .execute())
+            query = (supabase.table('transactions')
+                    .select(columns)
+                    .gte('timestamp', cutoff_time.isoformat())
+                    .order('timestamp', desc=True))
+            if limit:
+                query = query.limit(limit)
+            response = query.execute()
             return response.data if response.data else []
         except Exception as e:
-            logger.error(f"Error fetching recent transactions: {str(e)}")
-            return []
+            logger.error("Error fetching recent transactions: %s", e)
+            return None
+    
+    @staticmethod
+    def invalidate_recent(transaction: Optional[Dict] = None) -> None:
+        """Keep the recent-transactions cache coherent after a write.
+        
+        When the stored row is given it is pushed onto every cached window it
+        falls inside instead of forcing a refetch; otherwise the cache is cleared.
+        """
+        global _recent_cache_version
+        
+        with _recent_cache_lock:
+            _recent_cache_version += 1
+            if transaction is None:
+                _recent_cache.clear()
+                return
+            
+            timestamp = epoch_seconds(transaction.get('timestamp'))
+            now = epoch_seconds(datetime.now())
+            for (hours, columns, limit), cached in _recent_cache.items():
+                if timestamp is None or timestamp < now - hours * 3600:
+                    continue
+                if columns == '*':
+                    row = transaction
+                else:
+                    row = {column: transaction.get(column) for column in columns.split(',')}
+                # Mutate in place: re-assigning would restart the entry's TTL
+                cached.insert(0, row)
+                if limit:
+                    del cached[limit:]
+    
+    @staticmethod
+    def get_stats_summary() -> Optional[Dict]:
+        """Get aggregated system statistics from the stats_summary RPC."""
+        if not supabase:
+            return None
+        
+        with _stats_cache_lock:
+            summary = _stats_cache.get('summary')
+            if summary is not None:
+                return summary
+            
+            try:
+                response = supabase.rpc('stats_summary').execute()
+                if not response.data:
+                    logger.error("Failed to get stats summary: %s", response)
+                    return None
+                _stats_cache['summary'] = response.data
+                return response.data
+            except Exception as e:
+                logger.error("Error getting stats summary: %s", e)
+                return None
     
     @staticmethod
     def store_verification_attempt(verification_data: Dict) -> Optional[str]:
@@ -116,14 +473,14 @@ class DatabaseManager:
             
             if response.data:
                 verification_id = response.data[0]['id']
-                logger.info(f"Verification attempt stored: {verification_id}")
+                logger.info("Verification attempt stored: %s", verification_id)
                 return verification_id
             else:
-                logger.error(f"Failed to store verification attempt: {response}")
+                logger.error("Failed to store verification attempt: %s", response)
                 return None
                 
         except Exception as e:
-            logger.error(f"Error storing verification attempt: {str(e)}")
+            logger.error("Error storing verification attempt: %s", e)
             return None
     
     @staticmethod
@@ -137,16 +494,37 @@ class DatabaseManager:
             
             if response.data:
                 alert_id = response.data[0]['id']
-                logger.info(f"Fraud alert stored: {alert_id}")
+                logger.info("Fraud alert stored: %s", alert_id)
                 return alert_id
             else:
-                logger.error(f"Failed to store fraud alert: {response}")
+                logger.error("Failed to store fraud alert: %s", response)
                 return None
                 
         except Exception as e:
-            logger.error(f"Error storing fraud alert: {str(e)}")
+            logger.error("Error storing fraud alert: %s", e)
             return None
     
+    @staticmethod
+    def store_fraud_alerts(alerts_data: List[Dict]) -> List[str]:
+        """Store several fraud alerts with a single insert."""
+        if not supabase or not alerts_data:
+            return []
+        
+        try:
+            response = supabase.table('fraud_alerts').insert(alerts_data).execute()
+            
+            if response.data:
+                alert_ids = [alert['id'] for alert in response.data]
+                logger.info("Fraud alerts stored: %s", alert_ids)
+                return alert_ids
+            else:
+                logger.error("Failed to store fraud alerts: %s", response)
+                return []
+                
+        except Exception as e:
+            logger.error("Error storing fraud alerts: %s", e)
+            return []
+    
     @staticmethod
     def log_sms_processing(log_data: Dict) -> None:
         """Log SMS processing attempt."""
@@ -156,12 +534,337 @@ class DatabaseManager:
         try:
             supabase.table('sms_processing_logs').insert(log_data).execute()
         except Exception as e:
-            logger.error(f"Error logging SMS processing: {str(e)}")
+            logger.error("Error logging SMS processing: %s", e)
 
 db = DatabaseManager()
 
+class BloomFilter:
+    """Fixed-size Bloom filter over strings: no false negatives, rare false positives."""
+    
+    def __init__(self, capacity: int, error_rate: float = 1e-4):
+        self.size = max(8, int(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+    
+    def _positions(self, item: str):
+        """Derive the bit positions for an item by double hashing one digest."""
+        digest = hashlib.blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+    
+    def add(self, item: str) -> None:
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+    
+    def __contains__(self, item: str) -> bool:
+        return all(self._bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+_seen_txids: Optional[BloomFilter] = None
+_seen_txids_lock = threading.Lock()
+
+def seen_txids() -> Optional[BloomFilter]:
+    """Get the Bloom filter of stored TxIDs, loading it on first use.
+    
+    Returns None while it cannot be loaded, so the next call retries.
+    """
+    global _seen_txids
+    
+    if _seen_txids is None:
+        with _seen_txids_lock:
+            if _seen_txids is None:
+                tx_ids = db.get_stored_txids(SEEN_TXID_CAPACITY)
+                if tx_ids is None:
+                    return None
+                bloom = BloomFilter(SEEN_TXID_CAPACITY)
+                for tx_id in tx_ids:
+                    bloom.add(tx_id)
+                _seen_txids = bloom
+    return _seen_txids
+
+def find_stored_transaction(tx_id: Optional[str]) -> Optional[Dict]:
+    """Get the already-stored transaction for a TxID, querying only on Bloom filter hits."""
+    if not tx_id:
+        return None
+    
+    # Without a loaded filter a miss proves nothing, so fall through to the lookups
+    bloom = seen_txids()
+    if bloom is not None and tx_id not in bloom:
+        return None
+    
+    # A hit may be a false positive, so confirm locally first and then in the database
+    transaction = verification_store.lookup(tx_id)
+    if transaction:
+        return transaction
+    
+    transactions = db.get_transactions_by_txid(tx_id)
+    return transactions[0] if transactions else None
+
+def _prepare_snapshot_dir() -> bool:
+    """Create the snapshot directory, returning whether it is safe to trust its files."""
+    try:
+        os.makedirs(SNAPSHOT_DIR, mode=0o700, exist_ok=True)
+        dir_stat = os.lstat(SNAPSHOT_DIR)
+    except OSError as e:
+        logger.warning("Snapshot directory unavailable, fetching transactions directly: %s", e)
+        return False
+    
+    # The parent is world-writable, so someone else may have created the directory first
+    if (not stat.S_ISDIR(dir_stat.st_mode) or dir_stat.st_uid != os.getuid()
+            or dir_stat.st_mode & 0o077):
+        logger.warning("Snapshot directory %s is not private, fetching transactions directly", SNAPSHOT_DIR)
+        return False
+    return True
+
+_snapshot_dir_private = _prepare_snapshot_dir()
+
+class TransactionStore(ABC):
+    """In-memory snapshot of a recent transaction window.
+    
+    Subclasses keep the one view of the window they serve. Updated in place as
+    new SMS are ingested and reloaded once per cache TTL from a snapshot file
+    shared by all workers, which only one worker at a time refreshes from Supabase.
+    """
+    
+    def __init__(self, hours: int = 24, columns: str = '*'):
+        self.hours = hours
+        self.columns = columns
+        self._snapshot_path = os.path.join(SNAPSHOT_DIR, f'momo_transactions_{hours}h.json')
+        self._view = None
+        self._view_ids = set()
+        self._recent_adds: deque = deque()  # (time added, transaction), oldest first
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+    
+    def _load_snapshot(self) -> List[Dict]:
+        """Read the shared snapshot, refreshing it from Supabase if it is stale."""
+        lock_file = None
+        if _snapshot_dir_private:
+            try:
+                lock_file = open(f'{self._snapshot_path}.lock', 'w')
+            except OSError as e:
+                logger.warning("Snapshot directory unavailable, fetching directly: %s", e)
+        
+        if lock_file is None:
+            self._loaded_at = time.time()
+            return db.fetch_recent_transactions(self.hours, self.columns) or []
+        
+        with lock_file:
+            # Workers that arrive while another refreshes wait here and then read its result
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                loaded_at = os.path.getmtime(self._snapshot_path)
+                if time.time() - loaded_at <= RECENT_CACHE_TTL:
+                    with open(self._snapshot_path, 'rb') as f:
+                        transactions = orjson.loads(f.read())
+                    self._loaded_at = loaded_at
+                    return transactions
+            except (OSError, orjson.JSONDecodeError):
+                pass
+            
+            # Straight from the database: going through the recent-transactions cache
+            # could hand other workers a snapshot already a cache TTL old
+            transactions = db.fetch_recent_transactions(self.hours, self.columns)
+            self._loaded_at = time.time()
+            if transactions is None:
+                # Don't publish a failed fetch as an empty window for every worker
+                return []
+            try:
+                tmp_path = f'{self._snapshot_path}.{os.getpid()}'
+                # Rows carry phone numbers, balances and raw SMS, so keep them owner-only
+                fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(orjson.dumps(transactions))
+                os.replace(tmp_path, self._snapshot_path)
+            except OSError as e:
+                logger.warning("Error writing transaction snapshot: %s", e)
+            return transactions
+    
+    @abstractmethod
+    def _build(self, transactions: List[Dict]):
+        """Build this store's view of the window."""
+    
+    @abstractmethod
+    def _extend(self, transaction: Dict) -> None:
+        """Fold one new transaction into the view."""
+    
+    def _current(self):
+        """Get the view, reloading the snapshot when it is stale (caller holds the lock)."""
+        if self._view is None or time.time() - self._loaded_at > RECENT_CACHE_TTL:
+            transactions = self._load_snapshot()
+            self._view = self._build(transactions)
+            self._view_ids = {transaction.get('id') for transaction in transactions}
+            
+            # The snapshot may predate rows this worker stored since, so replay them on top
+            self._prune_recent_adds()
+            for _, transaction in self._recent_adds:
+                self._apply(transaction)
+        return self._view
+    
+    def _prune_recent_adds(self) -> None:
+        """Forget added rows that any snapshot still considered fresh already contains."""
+        # A fresh snapshot is at most one TTL old, and its fetch started at most one timeout before that
+        horizon = time.time() - RECENT_CACHE_TTL - SUPABASE_TIMEOUT
+        while self._recent_adds and self._recent_adds[0][0] < horizon:
+            self._recent_adds.popleft()
+    
+    def _apply(self, transaction: Dict) -> None:
+        """Fold a transaction into the view unless it is already there."""
+        # A row committed while a reload was fetching may already be in the view
+        if self._view is None or transaction['id'] in self._view_ids:
+            return
+        self._view_ids.add(transaction['id'])
+        self._extend(transaction)
+    
+    def add(self, transaction: Dict) -> None:
+        """Append a newly ingested transaction to the snapshot."""
+        with self._lock:
+            self._prune_recent_adds()
+            self._recent_adds.append((time.time(), transaction))
+            self._apply(transaction)
+
+class HistoryStore(TransactionStore):
+    """Transaction window kept as a columnar TransactionHistory for fraud scoring."""
+    
+    def _build(self, transactions: List[Dict]) -> TransactionHistory:
+        return fraud_detector.build_history(transactions)
+    
+    def _extend(self, transaction: Dict) -> None:
+        self._view.add(transaction.get('amount'), transaction.get('timestamp'), transaction.get('tx_id'))
+    
+    def history(self) -> TransactionHistory:
+        """Get the current columnar history."""
+        with self._lock:
+            return self._current()
+
+class IndexStore(TransactionStore):
+    """Transaction window kept as a TxID matching index for verification."""
+    
+    def _build(self, transactions: List[Dict]) -> TransactionIndex:
+        # Rows arrive newest first, so the index maps each TxID to its newest row
+        return txid_matcher.build_index(transactions)
+    
+    def _extend(self, transaction: Dict) -> None:
+        txid_matcher.add_to_index(self._view, transaction)
+    
+    def index(self) -> TransactionIndex:
+        """Get the current TxID matching index."""
+        with self._lock:
+            return self._current()
+    
+    def lookup(self, tx_id: str) -> Optional[Dict]:
+        """Get the transaction stored under exactly this TxID, if any."""
+        with self._lock:
+            return self._current().by_txid.get(txid_matcher.normalize_txid(tx_id))
+
+transaction_store = HistoryStore(24, FRAUD_HISTORY_COLUMNS)
+verification_store = IndexStore(48)
+
+def _drain_ingest_queue() -> None:
+    """Background worker writing queued rows to Supabase in batches."""
+    while True:
+        batch = [ingest_queue.get()]
+        while len(batch) < INGEST_BATCH_SIZE:
+            try:
+                batch.append(ingest_queue.get_nowait())
+            except queue.Empty:
+                break
+        
+        try:
+            for transaction in db.ingest_batch(batch):
+                track_stored_transaction(transaction)
+        except Exception as e:
+            logger.error("Error draining ingest queue: %s", e)
+        finally:
+            for _ in batch:
+                ingest_queue.task_done()
+
+def start_ingest_worker() -> None:
+    """Start the background ingest worker for this process if it is not running."""
+    global _ingest_worker
+    
+    if _ingest_worker is not None and _ingest_worker.is_alive():
+        return
+    
+    with _ingest_worker_lock:
+        if _ingest_worker is None or not _ingest_worker.is_alive():
+            _ingest_worker = threading.Thread(target=_drain_ingest_queue, name='sms-ingest', daemon=True)
+            _ingest_worker.start()
+
+def track_stored_transaction(transaction: Dict) -> None:
+    """Make a transaction confirmed written visible to fraud checks, verification and duplicate detection."""
+    transaction_store.add(transaction)
+    verification_store.add(transaction)
+    
+    # An unloaded filter picks this row up from the database once it loads
+    bloom = seen_txids()
+    if bloom is None:
+        return
+    # Bit updates are read-modify-write, so concurrent adds could drop each other's bits
+    with _seen_txids_lock:
+        bloom.add(transaction['tx_id'])
+
+def enqueue_ingest(transaction_data: Optional[Dict], alerts_data: List[Dict], log_data: Dict,
+                   transaction_id: Optional[str] = None) -> None:
+    """Queue SMS rows for the background worker, writing inline if the queue is full.
+    
+    The in-memory stores only pick the transaction up once it has been written,
+    so nothing can match or be scored against a row the database rejected.
+    Without transaction_data, alerts and log are linked to the given
+    already-stored transaction_id.
+    """
+    # Started lazily so it runs in each gunicorn worker rather than the preloading master
+    start_ingest_worker()
+    
+    try:
+        ingest_queue.put_nowait({
+            'transaction': transaction_data,
+            'transaction_id': transaction_id,
+            'fraud_alerts': alerts_data,
+            'log': log_data
+        })
+    except queue.Full:
+        logger.warning("Ingest queue full, writing SMS synchronously")
+        if transaction_data:
+            transaction_id = db.ingest_sms(transaction_data, alerts_data, log_data)
+            if transaction_id:
+                track_stored_transaction({**transaction_data, 'id': transaction_id})
+        else:
+            db.store_fraud_alerts([{**alert, 'transaction_id': transaction_id} for alert in alerts_data])
+            db.log_sms_processing({**log_data, 'transaction_id': transaction_id})
+
+def enqueue_verification(verification_data: Dict) -> None:
+    """Queue a verification attempt behind any SMS rows it may reference."""
+    start_ingest_worker()
+    
+    try:
+        ingest_queue.put_nowait({'verification': verification_data})
+    except queue.Full:
+        logger.warning("Ingest queue full, writing verification attempt synchronously")
+        db.store_verification_attempt(verification_data)
+
+@atexit.register
+def flush_ingest_queue() -> None:
+    """Write out anything still queued when the process exits."""
+    batch = []
+    while True:
+        try:
+            batch.append(ingest_queue.get_nowait())
+        except queue.Empty:
+            break
+    
+    for i in range(0, len(batch), INGEST_BATCH_SIZE):
+        db.ingest_batch(batch[i:i + INGEST_BATCH_SIZE])
+
 # API Routes
 
+@app.before_request
+def capture_request_time():
+    """Capture one timestamp per request for the handlers to share."""
+    g.now = datetime.now()
+    g.now_iso = g.now.isoformat()
+    g.start_ns = time.monotonic_ns()
+
 @app.route('/')
 def index():
     """Main payment verification page."""
@@ -172,7 +875,7 @@ def health_check():
     """Health check endpoint."""
     return jsonify({
         'status': 'healthy',
-        'timestamp': datetime.now().isoformat(),
+        'timestamp': g.now_iso,
         'services': {
             'supabase': supabase is not None,
             'sms_parser': True,
@@ -184,8 +887,6 @@ def health_check():
 @app.route('/api/sms/process', methods=['POST'])
 def process_sms():
     """Process incoming SMS message from Android forwarder."""
-    start_time = datetime.now()
-    
     try:
         # Get SMS data from request
         data = request.get_json()
@@ -196,27 +897,53 @@ def process_sms():
             }), 400
         
         raw_message = data['message']
+        if not isinstance(raw_message, str) or len(raw_message) > MAX_SMS_LENGTH:
+            return jsonify({
+                'success': False,
+                'error': 'Invalid message'
+            }), 400
+        
         sender = data.get('sender', 'Unknown')
         received_at = data.get('timestamp')
         
         if received_at:
             try:
-                received_at = datetime.fromisoformat(received_at.replace('Z', '+00:00'))
-            except:
-                received_at = datetime.now()
+                # Python 3.11+ parses a trailing 'Z' natively, no string rewrite needed
+                received_at = datetime.fromisoformat(received_at)
+            except (TypeError, ValueError):
+                received_at = g.now
         else:
-            received_at = datetime.now()
+            received_at = g.now
         
-        logger.info(f"Processing SMS from {sender}: {raw_message[:100]}...")
+        logger.info("Processing SMS from %s: %.100s...", sender, raw_message)
         
         # Parse the SMS
         parsed_data = sms_parser.parse_sms(raw_message)
         
-        processing_time = (datetime.now() - start_time).total_seconds() * 1000
+        processing_time = (time.monotonic_ns() - g.start_ns) / 1_000_000
         
-        if parsed_data.get('parsed_successfully'):
-            # Prepare transaction data for database
+        if parsed_data.get('parsed_successfully') and not parsed_data.get('tx_id'):
+            # transactions.tx_id is NOT NULL, so a row without one could never be stored
+            log_data = {
+                'raw_message': raw_message,
+                'parsed_successfully': False,
+                'error_message': f"No transaction ID in {parsed_data.get('message_type')} message",
+                'processing_time_ms': int(processing_time)
+            }
+            enqueue_ingest(None, [], log_data)
+            
+            return jsonify({
+                'success': False,
+                'error': 'No transaction ID found in SMS',
+                'parsed_data': parsed_data,
+                'processing_time_ms': processing_time
+            })
+        
+        elif parsed_data.get('parsed_successfully'):
+            # Prepare transaction data for database (the id is generated here so it
+            # can be returned before the background worker writes the row)
             transaction_data = {
+                'id': str(uuid.uuid4()),
                 'tx_id': parsed_data.get('tx_id'),
                 'message_type': parsed_data.get('message_type'),
                 'amount': parsed_data.get('amount', 0),
@@ -227,7 +954,7 @@ def process_sms():
                 'receiver_phone': parsed_data.get('receiver_phone'),
                 'receiver_code': parsed_data.get('receiver_code'),
                 'new_balance': parsed_data.get('new_balance'),
-                'timestamp': parsed_data.get('timestamp') or received_at,
+                'timestamp': (parsed_data.get('timestamp') or received_at).isoformat(),
                 'raw_message': raw_message,
                 'external_tx_id': parsed_data.get('external_tx_id'),
                 'token': parsed_data.get('token'),
@@ -236,38 +963,47 @@ def process_sms():
                 'agent_phone': parsed_data.get('agent_phone')
             }
             
-            # Store transaction
-            transaction_id = db.store_transaction(transaction_data)
+            # Forwarders often re-send the same SMS; don't insert a TxID we already have
+            stored_transaction = find_stored_transaction(transaction_data['tx_id'])
             
-            # Run fraud detection
-            recent_transactions = db.get_recent_transactions(24)
-            risk_score, fraud_alerts = fraud_detector.analyze_transaction(
-                parsed_data, recent_transactions, recent_transactions
-            )
+            if stored_transaction and (stored_transaction.get('raw_message') or '').strip() == raw_message.strip():
+                # A resend of the stored SMS was already scored when it first arrived
+                risk_score, fraud_alerts = 0.0, []
+            else:
+                # Run fraud detection against the in-memory 24h window; a different
+                # message reusing a stored TxID is what the duplicate check is for
+                risk_score, fraud_alerts = fraud_detector.analyze_transaction(
+                    parsed_data, transaction_store.history(), now=g.now
+                )
             
-            # Store fraud alerts if any
-            if fraud_alerts:
-                for alert in fraud_alerts:
-                    alert_data = {
-                        'transaction_id': transaction_id,
-                        'alert_type': alert.alert_type,
-                        'risk_score': alert.risk_score,
-                        'description': alert.description
-                    }
-                    db.store_fraud_alert(alert_data)
+            alerts_data = [
+                {
+                    'alert_type': alert.alert_type,
+                    'risk_score': alert.risk_score,
+                    'description': alert.description
+                } for alert in fraud_alerts
+            ]
             
-            # Log processing
             log_data = {
                 'raw_message': raw_message,
                 'parsed_successfully': True,
-                'transaction_id': transaction_id,
+                'error_message': None,
                 'processing_time_ms': int(processing_time)
             }
-            db.log_sms_processing(log_data)
+            
+            if stored_transaction:
+                logger.info("Duplicate SMS for TxID %s, skipping insert", transaction_data['tx_id'])
+                transaction_id = stored_transaction.get('id')
+                enqueue_ingest(None, alerts_data, log_data, transaction_id)
+            else:
+                # Store transaction, fraud alerts and processing log in the background
+                transaction_id = transaction_data['id']
+                enqueue_ingest(transaction_data, alerts_data, log_data)
             
             return jsonify({
                 'success': True,
                 'transaction_id': transaction_id,
+                'duplicate': stored_transaction is not None,
                 'parsed_data': parsed_data,
                 'fraud_analysis': {
                     'risk_score': risk_score,
@@ -275,7 +1011,7 @@ def process_sms():
                     'should_block': fraud_detector.should_block_transaction(risk_score)
                 },
                 'processing_time_ms': processing_time
-            })
+            }), 202
         
         else:
             # Log failed parsing
@@ -285,7 +1021,7 @@ def process_sms():
                 'error_message': parsed_data.get('error', 'Unknown parsing error'),
                 'processing_time_ms': int(processing_time)
             }
-            db.log_sms_processing(log_data)
+            enqueue_ingest(None, [], log_data)
             
             return jsonify({
                 'success': False,
@@ -295,8 +1031,8 @@ def process_sms():
             })
     
     except Exception as e:
-        processing_time = (datetime.now() - start_time).total_seconds() * 1000
-        logger.error(f"Error processing SMS: {str(e)}")
+        processing_time = (time.monotonic_ns() - g.start_ns) / 1_000_000
+        logger.error("Error processing SMS: %s", e)
         
         # Log error
         if 'raw_message' in locals():
@@ -306,7 +1042,7 @@ def process_sms():
                 'error_message': str(e),
                 'processing_time_ms': int(processing_time)
             }
-            db.log_sms_processing(log_data)
+            enqueue_ingest(None, [], log_data)
         
         return jsonify({
             'success': False,
@@ -335,56 +1071,76 @@ def verify_payment():
                 'error': 'Transaction ID is required'
             }), 400
         
-        if not verification_code or verification_code != DEFAULT_VERIFICATION_CODE:
+        # Cheap C-level string checks reject garbage before any lookup work
+        if (len(tx_id) > MAX_TXID_LENGTH or not tx_id.isascii() 
+                or not txid_matcher.normalize_txid(tx_id)):
+            return jsonify({
+                'success': False,
+                'error': 'Invalid transaction ID format'
+            }), 400
+        
+        # Constant-time comparison so response timing doesn't leak the code;
+        # checked before any transaction lookup so unauthenticated calls cost nothing
+        if not hmac.compare_digest(verification_code.encode(), _VERIFICATION_CODE_BYTES):
             return jsonify({
                 'success': False,
                 'error': 'Invalid verification code'
             }), 400
         
-        logger.info(f"Verifying payment with TxID: {tx_id}")
+        logger.info("Verifying payment with TxID: %s", tx_id)
+        
+        # Match against the in-memory 48 hour window; exact hits are a hash lookup
+        transaction_index = verification_store.index()
         
-        # Get recent transactions from database
-        recent_transactions = db.get_recent_transactions(48)  # 48 hours window
+        # This worker's copy of the window lacks rows written by other workers since its
+        # last refresh, so confirm an exact miss in the database before fuzzy and
+        # time-based matching get the chance to pick a different payment
+        normalized_txid = txid_matcher.normalize_txid(tx_id)
+        if normalized_txid not in transaction_index.by_txid:
+            stored_transactions = db.get_transactions_by_txid(normalized_txid)
+            if stored_transactions:
+                transaction_index = txid_matcher.build_index(stored_transactions)
         
-        if not recent_transactions:
+        if not transaction_index.candidates:
             return jsonify({
                 'success': False,
                 'error': 'No recent transactions found. Please ensure SMS forwarding is working.',
                 'recommendation': 'Check your SMS forwarder app or try again later'
             })
         
-        # Find matching transaction
-        match_result = txid_matcher.find_match(tx_id, recent_transactions)
+        match_result = txid_matcher.find_match(tx_id, transaction_index, verification_time=g.now)
         
         # Verify transaction details
         verification_result = txid_matcher.verify_transaction_details(
-            match_result, expected_amount
+            match_result, expected_amount, now=g.now
         )
         
         # Generate comprehensive report
         report = txid_matcher.generate_verification_report(
-            tx_id, match_result, verification_result
+            tx_id, match_result, verification_result, now=g.now
         )
         
-        # Store verification attempt
+        # Store verification attempt in the background (the id is generated here
+        # so the response does not wait on the insert)
         verification_data = {
+            'id': str(uuid.uuid4()),
             'verification_code_id': None,  # We'd need to look up the verification code ID
             'transaction_id': match_result.transaction.get('id') if match_result.transaction else None,
             'tx_id': tx_id,
             'status': 'verified' if verification_result.get('verified') else 'failed',
-            'verified_at': datetime.now() if verification_result.get('verified') else None,
+            'verified_at': g.now_iso if verification_result.get('verified') else None,
             'ip_address': request.environ.get('REMOTE_ADDR'),
             'user_agent': request.environ.get('HTTP_USER_AGENT')
         }
         
-        verification_id = db.store_verification_attempt(verification_data)
+        enqueue_verification(verification_data)
         
         # Prepare response
         response_data = {
             'success': verification_result.get('verified', False),
-            'verification_id': verification_id,
+            'verification_id': verification_data['id'],
             'report': report,
-            'timestamp': datetime.now().isoformat()
+            'timestamp': g.now_iso
         }
         
         if not verification_result.get('verified'):
@@ -393,7 +1149,7 @@ def verify_payment():
         return jsonify(response_data)
     
     except Exception as e:
-        logger.error(f"Error verifying payment: {str(e)}")
+        logger.error("Error verifying payment: %s", e)
         return jsonify({
             'success': False,
             'error': 'Internal server error during verification'
@@ -406,11 +1162,7 @@ def get_recent_transactions():
         hours = int(request.args.get('hours', 24))
         limit = int(request.args.get('limit', 50))
         
-        transactions = db.get_recent_transactions(hours)
-        
-        # Limit results
-        if limit:
-            transactions = transactions[:limit]
+        transactions = db.get_recent_transactions(hours, RECENT_LISTING_COLUMNS, limit)
         
         return jsonify({
             'success': True,
@@ -419,7 +1171,7 @@ def get_recent_transactions():
         })
     
     except Exception as e:
-        logger.error(f"Error fetching recent transactions: {str(e)}")
+        logger.error("Error fetching recent transactions: %s", e)
         return jsonify({
             'success': False,
             'error': 'Failed to fetch transactions'
@@ -446,7 +1198,7 @@ def search_transactions():
         })
     
     except Exception as e:
-        logger.error(f"Error searching transactions: {str(e)}")
+        logger.error("Error searching transactions: %s", e)
         return jsonify({
             'success': False,
             'error': 'Search failed'
@@ -462,46 +1214,31 @@ def get_stats():
                 'error': 'Database not available'
             }), 503
         
-        # Get transaction stats
-        transactions_response = supabase.table('transactions').select('id', 'message_type', 'amount', 'timestamp').execute()
-        transactions = transactions_response.data if transactions_response.data else []
-        
-        # Get verification stats
-        verifications_response = supabase.table('payment_verifications').select('id', 'status', 'created_at').execute()
-        verifications = verifications_response.data if verifications_response.data else []
-        
-        # Calculate stats
-        total_transactions = len(transactions)
-        total_verifications = len(verifications)
-        successful_verifications = len([v for v in verifications if v.get('status') == 'verified'])
-        
-        # Transaction types breakdown
-        type_breakdown = {}
-        for tx in transactions:
-            tx_type = tx.get('message_type', 'unknown')
-            type_breakdown[tx_type] = type_breakdown.get(tx_type, 0) + 1
+        summary = db.get_stats_summary()
+        if summary is None:
+            return jsonify({
+                'success': False,
+                'error': 'Failed to get statistics'
+            }), 500
         
-        # Recent activity (last 24 hours)
-        cutoff_time = datetime.now() - timedelta(hours=24)
-        recent_transactions = [tx for tx in transactions 
-                             if tx.get('timestamp') and 
-                             datetime.fromisoformat(tx['timestamp'].replace('Z', '+00:00')) > cutoff_time]
+        total_verifications = summary['total_verifications']
+        successful_verifications = summary['successful_verifications']
         
         return jsonify({
             'success': True,
             'stats': {
-                'total_transactions': total_transactions,
+                'total_transactions': summary['total_transactions'],
                 'total_verifications': total_verifications,
                 'successful_verifications': successful_verifications,
                 'verification_success_rate': (successful_verifications / max(total_verifications, 1)) * 100,
-                'recent_transactions_24h': len(recent_transactions),
-                'transaction_types': type_breakdown
+                'recent_transactions_24h': summary['recent_transactions_24h'],
+                'transaction_types': summary['transaction_types']
             },
-            'timestamp': datetime.now().isoformat()
+            'timestamp': g.now_iso
         })
     
     except Exception as e:
-        logger.error(f"Error getting stats: {str(e)}")
+        logger.error("Error getting stats: %s", e)
         return jsonify({
             'success': False,
             'error': 'Failed to get statistics'
@@ -543,8 +1280,8 @@ if os.getenv('FLASK_ENV') == 'development':
         data = request.get_json()
         transaction = data.get('transaction', {})
         
-        risk_score, alerts = fraud_detector.analyze_transaction(transaction)
-        report = fraud_detector.generate_fraud_report(transaction, risk_score, alerts)
+        risk_score, alerts = fraud_detector.analyze_transaction(transaction, now=g.now)
+        report = fraud_detector.generate_fraud_report(transaction, risk_score, alerts, now=g.now)
         
         return jsonify(report)
 
@@ -552,8 +1289,8 @@ if __name__ == '__main__':
     port = int(os.getenv('PORT', 5000))
     debug = os.getenv('FLASK_ENV') == 'development'
     
-    logger.info(f"Starting MoMo Payment Verification System on port {port}")
-    logger.info(f"Debug mode: {debug}")
-    logger.info(f"Verification code: {DEFAULT_VERIFICATION_CODE}")
+    logger.info("Starting MoMo Payment Verification System on port %s", port)
+    logger.info("Debug mode: %s", debug)
+    logger.info("Verification code: %s", DEFAULT_VERIFICATION_CODE)
     
     app.run(host='0.0.0.0', port=port, debug=debug)
@@ -118,6 +118,69 @@ CREATE TRIGGER update_transactions_updated_at BEFORE UPDATE ON transactions
 CREATE TRIGGER update_verification_codes_updated_at BEFORE UPDATE ON verification_codes 
     FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
 
+-- Ingest a parsed SMS (transaction, fraud alerts and processing log) in a single call
+CREATE OR REPLACE FUNCTION ingest_sms(payload JSONB)
+RETURNS UUID AS $$
+DECLARE
+    new_transaction_id UUID;
+BEGIN
+    INSERT INTO transactions (
+        id, tx_id, message_type, amount, fee, sender_name, sender_phone,
+        receiver_name, receiver_phone, receiver_code, new_balance, timestamp,
+        raw_message, external_tx_id, token, message_from_sender, agent_name, agent_phone
+    )
+    SELECT
+        COALESCE(t.id, uuid_generate_v4()), t.tx_id, t.message_type, t.amount, COALESCE(t.fee, 0), t.sender_name, t.sender_phone,
+        t.receiver_name, t.receiver_phone, t.receiver_code, t.new_balance, t.timestamp,
+        t.raw_message, t.external_tx_id, t.token, t.message_from_sender, t.agent_name, t.agent_phone
+    FROM jsonb_populate_record(NULL::transactions, payload->'transaction') AS t
+    RETURNING id INTO new_transaction_id;
+
+    INSERT INTO fraud_alerts (transaction_id, alert_type, risk_score, description)
+    SELECT new_transaction_id, a.alert_type, a.risk_score, a.description
+    FROM jsonb_populate_recordset(NULL::fraud_alerts, COALESCE(payload->'fraud_alerts', '[]'::JSONB)) AS a;
+
+    INSERT INTO sms_processing_logs (raw_message, parsed_successfully, error_message, transaction_id, processing_time_ms)
+    SELECT l.raw_message, l.parsed_successfully, l.error_message, new_transaction_id, l.processing_time_ms
+    FROM jsonb_populate_record(NULL::sms_processing_logs, payload->'log') AS l;
+
+    RETURN new_transaction_id;
+END;
+$$ language 'plpgsql';
+
+-- Aggregate statistics for /api/stats without shipping every row to the app
+CREATE OR REPLACE FUNCTION stats_summary()
+RETURNS JSON AS $$
+    WITH transaction_counts AS (
+        SELECT
+            count(*) AS total_transactions,
+            count(*) FILTER (WHERE timestamp > NOW() - INTERVAL '24 hours') AS recent_transactions_24h
+        FROM transactions
+    ),
+    type_counts AS (
+        SELECT COALESCE(json_object_agg(message_type, type_count), '{}'::JSON) AS transaction_types
+        FROM (
+            SELECT message_type, count(*) AS type_count
+            FROM transactions
+            GROUP BY message_type
+        ) AS types
+    ),
+    verification_counts AS (
+        SELECT
+            count(*) AS total_verifications,
+            count(*) FILTER (WHERE status = 'verified') AS successful_verifications
+        FROM payment_verifications
+    )
+    SELECT json_build_object(
+        'total_transactions', transaction_counts.total_transactions,
+        'recent_transactions_24h', transaction_counts.recent_transactions_24h,
+        'transaction_types', type_counts.transaction_types,
+        'total_verifications', verification_counts.total_verifications,
+        'successful_verifications', verification_counts.successful_verifications
+    )
+    FROM transaction_counts, type_counts, verification_counts;
+$$ language 'sql' STABLE;
+
 -- RLS (Row Level Security) policies for multi-tenancy if needed
 ALTER TABLE transactions ENABLE ROW LEVEL SECURITY;
 ALTER TABLE verification_codes ENABLE ROW LEVEL SECURITY;
@@ -6,9 +6,13 @@ bind = f"0.0.0.0:{os.getenv('PORT', 5000)}"
 backlog = 2048
 
 # Worker processes
-workers = min(cpu_count() * 2 + 1, 4)  # Limit workers for free tier
-worker_class = "sync"
-worker_connections = 1000
+# Every endpoint spends most of its time waiting on Supabase over HTTPS, so
+# threaded workers overlap those waits instead of blocking a whole process.
+# The Supabase client wraps a thread-safe httpx.Client and is shared by the
+# threads of a worker; module-level caches in app.py are lock-protected.
+workers = min(cpu_count(), 2)  # Limit workers for free tier
+worker_class = "gthread"
+threads = 16
 timeout = 120
 keepalive = 2
 max_requests = 1000
@@ -50,6 +54,15 @@ def pre_fork(server, worker):
 def post_fork(server, worker):
     """Called just after a worker has been forked."""
     server.log.info(f"Worker spawned (pid: {worker.pid})")
+    
+    # The log listener goes first: it swaps in a fresh queue, so no record is left on
+    # the inherited one (which has no listener thread here) and no lock held at fork is touched
+    import app
+    app.start_log_listener()
+    
+    # Recreate the Supabase client so the worker keeps its own warm
+    # connections rather than sharing the master's across the fork
+    app.init_supabase()
 
 def worker_abort(worker):
     """Called when a worker received the SIGABRT signal."""
@@ -1,14 +1,36 @@
 import re
 import json
+from bisect import bisect_right, insort
+from collections import Counter
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple, Union
 import logging
 from dataclasses import dataclass
 
+from ml_models.timestamps import epoch_seconds, parse_timestamp
+
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-@dataclass
+# Message tampering indicators, fused so the message is scanned once
+_TAMPER_RE = re.compile(
+    r'(?P<unusual>[^\w\s\-\.\*:#(),]+)'  # Unusual characters
+    r'|(?P<decimals>(?<!\d)\d+\.\d{3,})'  # Too many decimal places; only from the start of a digit run
+    r'|(?P<rwf>RWF(?:(?!RWF).)*RWF)'  # Multiple RWF mentions; stops at the next RWF instead of backtracking
+)
+
+# Alert descriptions keep quoting the original per-indicator patterns
+_TAMPER_DESCRIPTIONS = {
+    'unusual': r'[^\w\s\-\.\*:#(),]+',
+    'decimals': r'\d+\.\d{3,}',
+    'rwf': r'(RWF.*RWF)',
+}
+
+# Shared empty window; build_history memoizes on identity, so a fresh [] per call
+# would rebuild the empty history and evict the cached one every time
+_NO_TRANSACTIONS = ()
+
+@dataclass(slots=True)
 class FraudAlert:
     """Data class for fraud alerts."""
     alert_type: str
@@ -16,6 +38,40 @@ class FraudAlert:
     description: str
     severity: str  # 'low', 'medium', 'high', 'critical'
 
+@dataclass
+class TransactionHistory:
+    """Columnar view of a transaction window, built once and shared by the checks."""
+    amounts: List[float]  # positive amounts only
+    amount_total: float
+    amount_max: float
+    timestamps: List[float]  # epoch seconds, sorted ascending
+    tx_ids: Counter  # occurrences of each TxID
+    
+    def add(self, amount: Optional[float], timestamp: Union[datetime, str, None],
+            tx_id: Optional[str] = None) -> None:
+        """Fold one new transaction into the columns without rebuilding them."""
+        if tx_id:
+            self.tx_ids[tx_id] += 1
+        
+        if amount and amount > 0:
+            self.amounts.append(amount)
+            self.amount_total += amount
+            self.amount_max = max(self.amount_max, amount)
+        
+        ts = epoch_seconds(timestamp)
+        if ts is not None:
+            insort(self.timestamps, ts)
+    
+    def copy(self) -> 'TransactionHistory':
+        """Copy the columns so the copy can be extended without touching this history."""
+        return TransactionHistory(
+            amounts=list(self.amounts),
+            amount_total=self.amount_total,
+            amount_max=self.amount_max,
+            timestamps=list(self.timestamps),
+            tx_ids=Counter(self.tx_ids)
+        )
+
 class FraudDetector:
     """Advanced fraud detection system for MoMo transactions."""
     
@@ -27,6 +83,10 @@ class FraudDetector:
             'critical': 0.95
         }
         
+        # Thresholds in ascending order, so a risk level is one bisect into them
+        self._risk_levels = sorted(self.risk_thresholds.items(), key=lambda item: item[1])
+        self._risk_level_bounds = [threshold for _, threshold in self._risk_levels]
+        
         # Fraud patterns and rules
         self.fraud_rules = {
             'duplicate_txid': {'weight': 0.9, 'description': 'Duplicate transaction ID detected'},
@@ -38,33 +98,73 @@ class FraudDetector:
             'balance_inconsistency': {'weight': 0.9, 'description': 'Balance calculation doesn\'t match'},
             'message_tampering': {'weight': 0.95, 'description': 'Potential message tampering detected'}
         }
+        
+        # Last history built, reused while the caller passes the same unchanged list
+        self._history_cache = None
+    
+    def build_history(self, transactions: Union[List[Dict], TransactionHistory]) -> TransactionHistory:
+        """Convert a list of transactions into the columnar form used by the checks."""
+        if isinstance(transactions, TransactionHistory):
+            return transactions
+        
+        cached = self._history_cache
+        if cached is not None and cached[0] is transactions and cached[1] == len(transactions):
+            return cached[2]
+        
+        amounts = []
+        timestamps = []
+        tx_ids = Counter()
+        for t in transactions:
+            if t.get('tx_id'):
+                tx_ids[t['tx_id']] += 1
+            amount = t.get('amount') or 0
+            if amount > 0:
+                amounts.append(amount)
+            ts = epoch_seconds(t.get('timestamp'))
+            if ts is not None:
+                timestamps.append(ts)
+        timestamps.sort()
+        
+        history = TransactionHistory(
+            amounts=amounts,
+            amount_total=sum(amounts),
+            amount_max=max(amounts) if amounts else 0.0,
+            timestamps=timestamps,
+            tx_ids=tx_ids
+        )
+        self._history_cache = (transactions, len(transactions), history)
+        return history
     
-    def check_duplicate_txid(self, tx_id: str, existing_transactions: List[Dict]) -> Optional[FraudAlert]:
-        """Check for duplicate transaction IDs."""
-        if not tx_id:
+    def check_duplicate_txid(self, tx_id: str, 
+                             existing_transactions: Union[List[Dict], TransactionHistory]) -> Optional[FraudAlert]:
+        """Check whether the TxID was already seen among the existing transactions."""
+        if not tx_id or not existing_transactions:
             return None
-            
-        duplicates = [t for t in existing_transactions if t.get('tx_id') == tx_id]
-        if len(duplicates) > 1:
+        
+        # The transaction under analysis is not part of the history, so one earlier hit is a duplicate
+        history = self.build_history(existing_transactions)
+        occurrences = history.tx_ids[tx_id] + 1
+        if occurrences > 1:
             return FraudAlert(
                 alert_type='duplicate_txid',
                 risk_score=self.fraud_rules['duplicate_txid']['weight'],
-                description=f"Transaction ID {tx_id} appears {len(duplicates)} times",
+                description=f"Transaction ID {tx_id} appears {occurrences} times",
                 severity='critical'
             )
         return None
     
-    def check_unusual_amount(self, amount: float, user_history: List[Dict]) -> Optional[FraudAlert]:
+    def check_unusual_amount(self, amount: float, 
+                             user_history: Union[List[Dict], TransactionHistory]) -> Optional[FraudAlert]:
         """Check for unusually high amounts compared to user's history."""
         if not user_history or amount <= 0:
             return None
         
-        amounts = [t.get('amount', 0) for t in user_history if t.get('amount', 0) > 0]
-        if not amounts:
+        history = self.build_history(user_history)
+        if not history.amounts:
             return None
         
-        avg_amount = sum(amounts) / len(amounts)
-        max_amount = max(amounts)
+        avg_amount = history.amount_total / len(history.amounts)
+        max_amount = history.amount_max
         
         # Check if current amount is significantly higher than average
         if amount > avg_amount * 10 or amount > max_amount * 2:
@@ -77,21 +177,22 @@ class FraudDetector:
             )
         return None
     
-    def check_rapid_transactions(self, timestamp: datetime, recent_transactions: List[Dict]) -> Optional[FraudAlert]:
+    def check_rapid_transactions(self, timestamp: datetime, 
+                                 recent_transactions: Union[List[Dict], TransactionHistory]) -> Optional[FraudAlert]:
         """Check for rapid succession of transactions."""
         if not recent_transactions:
             return None
         
         # Look for transactions in the last 5 minutes
-        five_minutes_ago = timestamp - timedelta(minutes=5)
-        recent = [t for t in recent_transactions 
-                 if t.get('timestamp') and t.get('timestamp') > five_minutes_ago]
+        history = self.build_history(recent_transactions)
+        five_minutes_ago = epoch_seconds(timestamp) - 5 * 60
+        recent_count = len(history.timestamps) - bisect_right(history.timestamps, five_minutes_ago)
         
-        if len(recent) >= 5:  # More than 5 transactions in 5 minutes
+        if recent_count >= 5:  # More than 5 transactions in 5 minutes
             return FraudAlert(
                 alert_type='rapid_transactions',
-                risk_score=min(0.9, len(recent) * 0.15),
-                description=f"{len(recent)} transactions in the last 5 minutes",
+                risk_score=min(0.9, recent_count * 0.15),
+                description=f"{recent_count} transactions in the last 5 minutes",
                 severity='high'
             )
         return None
@@ -159,52 +260,45 @@ class FraudDetector:
         raw_message = transaction.get('raw_message', '')
         
         # Look for unusual characters or formatting
-        suspicious_patterns = [
-            r'[^\w\s\-\.\*:#(),]+',  # Unusual characters
-            r'\d+\.\d{3,}',  # Too many decimal places
-            r'(RWF.*RWF)',  # Multiple RWF mentions in unusual way
-        ]
-        
-        for pattern in suspicious_patterns:
-            if re.search(pattern, raw_message):
-                return FraudAlert(
-                    alert_type='message_tampering',
-                    risk_score=0.8,
-                    description=f"Suspicious pattern in message: {pattern}",
-                    severity='high'
-                )
+        match = _TAMPER_RE.search(raw_message)
+        if match:
+            return FraudAlert(
+                alert_type='message_tampering',
+                risk_score=0.8,
+                description=f"Suspicious pattern in message: {_TAMPER_DESCRIPTIONS[match.lastgroup]}",
+                severity='high'
+            )
         
         return None
     
-    def analyze_transaction(self, transaction: Dict, user_history: List[Dict] = None, 
-                          existing_transactions: List[Dict] = None) -> Tuple[float, List[FraudAlert]]:
-        """Comprehensive fraud analysis of a transaction."""
-        alerts = []
-        
+    def analyze_transaction(self, transaction: Dict, 
+                          recent_transactions: Union[List[Dict], TransactionHistory] = None,
+                          now: Optional[datetime] = None) -> Tuple[float, List[FraudAlert]]:
+        """Comprehensive fraud analysis of a transaction against the recent window (excluding itself)."""
         # Get transaction details
         tx_id = transaction.get('tx_id')
         amount = transaction.get('amount', 0)
         timestamp = transaction.get('timestamp')
         
         if isinstance(timestamp, str):
-            try:
-                timestamp = datetime.fromisoformat(timestamp.replace('Z', '+00:00'))
-            except:
-                timestamp = datetime.now()
+            timestamp = parse_timestamp(timestamp) or now or datetime.now()
+        
+        # Convert the window to columns once for the duplicate, amount and velocity checks
+        history = self.build_history(recent_transactions or _NO_TRANSACTIONS)
         
-        # Run all fraud checks
-        checks = [
-            self.check_duplicate_txid(tx_id, existing_transactions or []),
-            self.check_unusual_amount(amount, user_history or []),
-            self.check_rapid_transactions(timestamp, user_history or []),
+        # Run all fraud checks, keeping the ones that fired
+        alerts = []
+        for alert in (
+            self.check_duplicate_txid(tx_id, history),
+            self.check_unusual_amount(amount, history),
+            self.check_rapid_transactions(timestamp, history),
             self.check_suspicious_timing(timestamp),
             self.check_amount_patterns(amount),
             self.check_balance_consistency(transaction),
             self.check_message_tampering(transaction)
-        ]
-        
-        # Filter out None results
-        alerts = [alert for alert in checks if alert is not None]
+        ):
+            if alert is not None:
+                alerts.append(alert)
         
         # Calculate overall risk score
         if not alerts:
@@ -219,25 +313,32 @@ class FraudDetector:
         
         return overall_risk, alerts
     
+    def analyze_transactions(self, transactions: List[Dict], 
+                           recent_transactions: Union[List[Dict], TransactionHistory] = None,
+                           now: Optional[datetime] = None) -> List[Tuple[float, List[FraudAlert]]]:
+        """Analyze a batch of transactions against one recent window and the batch entries before each."""
+        # Copied because earlier batch entries are folded in, so duplicates and bursts
+        # within the batch count without mutating the caller's (or the cached) history
+        history = self.build_history(recent_transactions or _NO_TRANSACTIONS).copy()
+        now = now or datetime.now()
+        
+        results = []
+        for transaction in transactions:
+            results.append(self.analyze_transaction(transaction, history, now))
+            history.add(transaction.get('amount'), transaction.get('timestamp'), transaction.get('tx_id'))
+        return results
+    
     def get_risk_level(self, risk_score: float) -> str:
         """Convert risk score to risk level."""
-        if risk_score >= self.risk_thresholds['critical']:
-            return 'critical'
-        elif risk_score >= self.risk_thresholds['high']:
-            return 'high'
-        elif risk_score >= self.risk_thresholds['medium']:
-            return 'medium'
-        elif risk_score >= self.risk_thresholds['low']:
-            return 'low'
-        else:
-            return 'safe'
+        position = bisect_right(self._risk_level_bounds, risk_score)
+        return self._risk_levels[position - 1][0] if position else 'safe'
     
     def should_block_transaction(self, risk_score: float) -> bool:
         """Determine if transaction should be blocked based on risk score."""
         return risk_score >= self.risk_thresholds['critical']
     
     def generate_fraud_report(self, transaction: Dict, risk_score: float, 
-                            alerts: List[FraudAlert]) -> Dict:
+                            alerts: List[FraudAlert], now: Optional[datetime] = None) -> Dict:
         """Generate a comprehensive fraud analysis report."""
         risk_level = self.get_risk_level(risk_score)
         should_block = self.should_block_transaction(risk_score)
@@ -256,7 +357,7 @@ class FraudDetector:
                     'severity': alert.severity
                 } for alert in alerts
             ],
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': (now or datetime.now()).isoformat(),
             'recommendation': self._get_recommendation(risk_level, should_block)
         }
     
@@ -1,15 +1,30 @@
 import re
 import json
+from bisect import bisect_left, bisect_right
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple, Union
 import logging
 from dataclasses import dataclass
 from difflib import SequenceMatcher
+from functools import lru_cache
+
+from ml_models.timestamps import epoch_seconds
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-@dataclass
+# Regex patterns are compiled once at import time rather than on every call
+_NORM_PREFIX_RE = re.compile(r'^(txid:?|id:?)')
+_NORM_CLEAN_RE = re.compile(r'[^0-9a-z]')
+
+# A single scan finds every "Id:" (covering the TxId:, *162*TxId:, Transaction Id: and
+# Financial Transaction Id: forms, whose values are their leading digits) and flags
+# External Transaction Ids, whose whole value is kept; the value is only looked ahead
+# at so an "Id:" inside it is still found
+_TXID_RE = re.compile(r'(?P<external>External Transaction )?Id:(?=\s*(?P<value>\S+))', re.IGNORECASE)
+_LEADING_DIGITS_RE = re.compile(r'\d+')
+
+@dataclass(slots=True)
 class MatchResult:
     """Data class for match results."""
     matched: bool
@@ -18,6 +33,14 @@ class MatchResult:
     match_type: str
     details: str
 
+@dataclass
+class TransactionIndex:
+    """Normalized TxIDs of a transaction list, built once and reused across lookups."""
+    candidates: List[Tuple[Dict, List[str]]]  # (transaction, its TxIDs) in list order
+    by_txid: Dict[str, Dict]  # every candidate TxID -> first transaction carrying it
+    times: List[float]  # epoch seconds of the timestamped transactions, sorted ascending
+    by_time: List[Tuple[Dict, List[str]]]  # candidates aligned with times
+
 class TxIDMatcher:
     """Advanced TxID matcher for payment verification."""
     
@@ -33,48 +56,43 @@ class TxIDMatcher:
         # Time window for matching (in minutes)
         self.matching_time_window = 60  # 1 hour
     
-    def normalize_txid(self, txid: str) -> str:
+    @staticmethod
+    @lru_cache(maxsize=10000)
+    def normalize_txid(txid: str) -> str:
         """Normalize transaction ID for better matching."""
         if not txid:
             return ""
         
         # Remove common prefixes/suffixes and clean
-        normalized = re.sub(r'^(txid:?|id:?)', '', str(txid).lower().strip())
-        normalized = re.sub(r'[^0-9a-z]', '', normalized)
+        normalized = _NORM_PREFIX_RE.sub('', str(txid).lower().strip())
+        normalized = _NORM_CLEAN_RE.sub('', normalized)
         return normalized
     
     def extract_all_possible_txids(self, transaction: Dict) -> List[str]:
         """Extract all possible transaction IDs from a transaction record."""
-        txids = []
+        txids = set()
         
         # Primary TxID
         if transaction.get('tx_id'):
-            txids.append(self.normalize_txid(transaction['tx_id']))
+            txids.add(self.normalize_txid(transaction['tx_id']))
         
         # External transaction ID
         if transaction.get('external_tx_id'):
-            txids.append(self.normalize_txid(transaction['external_tx_id']))
+            txids.add(self.normalize_txid(transaction['external_tx_id']))
         
-        # Extract from raw message using various patterns
+        # Extract from raw message in one pass over it
         raw_message = transaction.get('raw_message', '')
         if raw_message:
-            patterns = [
-                r'TxId:\s*(\d+)',
-                r'Transaction Id:\s*(\d+)',
-                r'Financial Transaction Id:\s*(\d+)',
-                r'\*162\*TxId:(\d+)',
-                r'External Transaction Id:\s*([^\s]+)',
-                r'Id:\s*(\d+)'
-            ]
-            
-            for pattern in patterns:
-                matches = re.findall(pattern, raw_message, re.IGNORECASE)
-                for match in matches:
-                    normalized = self.normalize_txid(match)
-                    if normalized and normalized not in txids:
-                        txids.append(normalized)
-        
-        return list(set(txids))  # Remove duplicates
+            for match in _TXID_RE.finditer(raw_message):
+                value = match.group('value')
+                digits = _LEADING_DIGITS_RE.match(value)
+                candidates = (digits.group() if digits else None, value if match.group('external') else None)
+                for candidate in candidates:
+                    normalized = self.normalize_txid(candidate)
+                    if normalized:
+                        txids.add(normalized)
+        
+        return list(txids)
     
     def calculate_string_similarity(self, str1: str, str2: str) -> float:
         """Calculate similarity between two strings."""
@@ -83,30 +101,69 @@ class TxIDMatcher:
         
         return SequenceMatcher(None, str1.lower(), str2.lower()).ratio()
     
+    def build_index(self, transactions: List[Dict]) -> TransactionIndex:
+        """Extract and hash every transaction's candidate TxIDs once for repeated matching."""
+        index = TransactionIndex(candidates=[], by_txid={}, times=[], by_time=[])
+        timed = []
+        for transaction in transactions:
+            txids = self.extract_all_possible_txids(transaction)
+            index.candidates.append((transaction, txids))
+            for txid in txids:
+                index.by_txid.setdefault(txid, transaction)
+            
+            # Timestamps are parsed once here rather than on every time-based match
+            ts = epoch_seconds(transaction.get('timestamp'))
+            if ts is not None:
+                timed.append((ts, transaction, txids))
+        
+        timed.sort(key=lambda x: x[0])
+        index.times = [ts for ts, _, _ in timed]
+        index.by_time = [(transaction, txids) for _, transaction, txids in timed]
+        return index
+    
+    def add_to_index(self, index: TransactionIndex, transaction: Dict) -> None:
+        """Put a newer transaction at the front of an existing index."""
+        txids = self.extract_all_possible_txids(transaction)
+        index.candidates.insert(0, (transaction, txids))
+        for txid in txids:
+            index.by_txid[txid] = transaction
+        
+        ts = epoch_seconds(transaction.get('timestamp'))
+        if ts is not None:
+            position = bisect_right(index.times, ts)
+            index.times.insert(position, ts)
+            index.by_time.insert(position, (transaction, txids))
+    
     def find_exact_match(self, target_txid: str, transactions: List[Dict]) -> Optional[MatchResult]:
         """Find exact TxID match."""
+        return self._find_exact_match(target_txid, self.build_index(transactions))
+    
+    def _find_exact_match(self, target_txid: str, index: TransactionIndex) -> Optional[MatchResult]:
+        """Find exact TxID match with a hash lookup in the index."""
         normalized_target = self.normalize_txid(target_txid)
         if not normalized_target:
             return None
         
-        for transaction in transactions:
-            txids = self.extract_all_possible_txids(transaction)
-            
-            for txid in txids:
-                if normalized_target == txid:
-                    return MatchResult(
-                        matched=True,
-                        confidence=1.0,
-                        transaction=transaction,
-                        match_type='exact',
-                        details=f'Exact match found for TxID: {target_txid}'
-                    )
+        transaction = index.by_txid.get(normalized_target)
+        if transaction is None:
+            return None
         
-        return None
+        return MatchResult(
+            matched=True,
+            confidence=1.0,
+            transaction=transaction,
+            match_type='exact',
+            details=f'Exact match found for TxID: {target_txid}'
+        )
     
     def find_fuzzy_match(self, target_txid: str, transactions: List[Dict], 
                         min_confidence: float = 0.8) -> Optional[MatchResult]:
         """Find fuzzy TxID match using string similarity."""
+        return self._find_fuzzy_match(target_txid, self.build_index(transactions), min_confidence)
+    
+    def _find_fuzzy_match(self, target_txid: str, index: TransactionIndex, 
+                          min_confidence: float = 0.8) -> Optional[MatchResult]:
+        """Find fuzzy TxID match among the indexed candidates."""
         normalized_target = self.normalize_txid(target_txid)
         if not normalized_target:
             return None
@@ -114,11 +171,21 @@ class TxIDMatcher:
         best_match = None
         best_confidence = 0.0
         
-        for transaction in transactions:
-            txids = self.extract_all_possible_txids(transaction)
-            
+        # Same ratio as calculate_string_similarity (normalized TxIDs are already lowercase),
+        # but candidates whose length-based upper bound can't beat the best so far are skipped
+        # before SequenceMatcher does any matching work
+        sequence_matcher = SequenceMatcher(None, normalized_target)
+        
+        for transaction, txids in index.candidates:
             for txid in txids:
-                similarity = self.calculate_string_similarity(normalized_target, txid)
+                if not txid:
+                    continue
+                
+                sequence_matcher.set_seq2(txid)
+                bound = max(best_confidence, min_confidence)
+                if sequence_matcher.real_quick_ratio() < bound or sequence_matcher.quick_ratio() < bound:
+                    continue
+                similarity = sequence_matcher.ratio()
                 
                 if similarity > best_confidence and similarity >= min_confidence:
                     best_confidence = similarity
@@ -139,43 +206,41 @@ class TxIDMatcher:
     def find_time_based_match(self, target_txid: str, verification_time: datetime, 
                             transactions: List[Dict]) -> Optional[MatchResult]:
         """Find match based on time proximity when TxID match is not exact."""
-        # Look for transactions around the verification time
-        time_window_start = verification_time - timedelta(minutes=self.matching_time_window)
-        time_window_end = verification_time + timedelta(minutes=self.matching_time_window)
+        return self._find_time_based_match(target_txid, verification_time, self.build_index(transactions))
+    
+    def _find_time_based_match(self, target_txid: str, verification_time: datetime, 
+                               index: TransactionIndex) -> Optional[MatchResult]:
+        """Find time-based match among the indexed candidates."""
+        # Look for transactions around the verification time; only the slice of the
+        # time-sorted index inside the window is visited
+        verification_ts = epoch_seconds(verification_time)
+        window_seconds = self.matching_time_window * 60
+        start = bisect_left(index.times, verification_ts - window_seconds)
+        end = bisect_right(index.times, verification_ts + window_seconds)
+        normalized_target = self.normalize_txid(target_txid)
         
-        candidates = []
+        matches = []
         
-        for transaction in transactions:
-            tx_time = transaction.get('timestamp')
-            if isinstance(tx_time, str):
-                try:
-                    tx_time = datetime.fromisoformat(tx_time.replace('Z', '+00:00'))
-                except:
-                    continue
+        for tx_ts, (transaction, txids) in zip(index.times[start:end], index.by_time[start:end]):
+            # Calculate time-based confidence
+            time_diff = abs(tx_ts - verification_ts) / 60  # minutes
+            time_confidence = max(0.0, 1.0 - (time_diff / self.matching_time_window))
             
-            if tx_time and time_window_start <= tx_time <= time_window_end:
-                # Calculate time-based confidence
-                time_diff = abs((tx_time - verification_time).total_seconds()) / 60  # minutes
-                time_confidence = max(0.0, 1.0 - (time_diff / self.matching_time_window))
-                
-                # Also consider partial TxID similarity
-                txids = self.extract_all_possible_txids(transaction)
-                max_txid_similarity = 0.0
-                
-                normalized_target = self.normalize_txid(target_txid)
-                for txid in txids:
-                    similarity = self.calculate_string_similarity(normalized_target, txid)
-                    max_txid_similarity = max(max_txid_similarity, similarity)
-                
-                # Combined confidence (time + partial TxID match)
-                combined_confidence = (time_confidence * 0.6) + (max_txid_similarity * 0.4)
-                
-                candidates.append((transaction, combined_confidence, time_diff))
+            # Also consider partial TxID similarity
+            max_txid_similarity = 0.0
+            for txid in txids:
+                similarity = self.calculate_string_similarity(normalized_target, txid)
+                max_txid_similarity = max(max_txid_similarity, similarity)
+            
+            # Combined confidence (time + partial TxID match)
+            combined_confidence = (time_confidence * 0.6) + (max_txid_similarity * 0.4)
+            
+            matches.append((transaction, combined_confidence, time_diff))
         
-        if candidates:
+        if matches:
             # Sort by confidence, then by time proximity
-            candidates.sort(key=lambda x: (x[1], -x[2]), reverse=True)
-            best_transaction, confidence, time_diff = candidates[0]
+            matches.sort(key=lambda x: (x[1], -x[2]), reverse=True)
+            best_transaction, confidence, time_diff = matches[0]
             
             if confidence >= 0.6:  # Minimum threshold for time-based matching
                 return MatchResult(
@@ -188,10 +253,14 @@ class TxIDMatcher:
         
         return None
     
-    def find_match(self, target_txid: str, transactions: List[Dict], 
+    def find_match(self, target_txid: str, transactions: Union[List[Dict], TransactionIndex], 
                    verification_time: datetime = None) -> MatchResult:
         """Main matching function that tries multiple strategies."""
-        if not target_txid or not transactions:
+        # Candidate TxIDs are extracted once and shared by all strategies; callers
+        # matching repeatedly against the same window can pass a prebuilt index
+        index = transactions if isinstance(transactions, TransactionIndex) else self.build_index(transactions or [])
+        
+        if not target_txid or not index.candidates:
             return MatchResult(
                 matched=False,
                 confidence=0.0,
@@ -204,19 +273,19 @@ class TxIDMatcher:
             verification_time = datetime.now()
         
         # Strategy 1: Exact match
-        exact_match = self.find_exact_match(target_txid, transactions)
+        exact_match = self._find_exact_match(target_txid, index)
         if exact_match:
             logger.info(f"Exact match found for TxID: {target_txid}")
             return exact_match
         
         # Strategy 2: Fuzzy match
-        fuzzy_match = self.find_fuzzy_match(target_txid, transactions)
+        fuzzy_match = self._find_fuzzy_match(target_txid, index)
         if fuzzy_match:
             logger.info(f"Fuzzy match found for TxID: {target_txid}")
             return fuzzy_match
         
         # Strategy 3: Time-based match (last resort)
-        time_match = self.find_time_based_match(target_txid, verification_time, transactions)
+        time_match = self._find_time_based_match(target_txid, verification_time, index)
         if time_match:
             logger.info(f"Time-based match found for TxID: {target_txid}")
             return time_match
@@ -231,7 +300,8 @@ class TxIDMatcher:
         )
     
     def verify_transaction_details(self, match_result: MatchResult, 
-                                 expected_amount: Optional[float] = None) -> Dict:
+                                 expected_amount: Optional[float] = None,
+                                 now: Optional[datetime] = None) -> Dict:
         """Verify additional transaction details beyond TxID matching."""
         if not match_result.matched or not match_result.transaction:
             return {
@@ -252,19 +322,12 @@ class TxIDMatcher:
                 verification_score *= 0.5  # Reduce confidence significantly
         
         # Check if transaction is recent (within reasonable time)
-        tx_time = transaction.get('timestamp')
-        if tx_time:
-            if isinstance(tx_time, str):
-                try:
-                    tx_time = datetime.fromisoformat(tx_time.replace('Z', '+00:00'))
-                except:
-                    tx_time = None
-            
-            if tx_time:
-                time_diff = (datetime.now() - tx_time).total_seconds() / 3600  # hours
-                if time_diff > 24:  # More than 24 hours old
-                    issues.append(f"Transaction is {time_diff:.1f} hours old")
-                    verification_score *= 0.8
+        tx_ts = epoch_seconds(transaction.get('timestamp'))
+        if tx_ts is not None:
+            time_diff = (epoch_seconds(now or datetime.now()) - tx_ts) / 3600  # hours
+            if time_diff > 24:  # More than 24 hours old
+                issues.append(f"Transaction is {time_diff:.1f} hours old")
+                verification_score *= 0.8
         
         # Check transaction type (should be payment_out or similar)
         tx_type = transaction.get('message_type')
@@ -287,7 +350,7 @@ class TxIDMatcher:
         }
     
     def generate_verification_report(self, target_txid: str, match_result: MatchResult, 
-                                   verification_result: Dict) -> Dict:
+                                   verification_result: Dict, now: Optional[datetime] = None) -> Dict:
         """Generate comprehensive verification report."""
         return {
             'target_txid': target_txid,
@@ -299,7 +362,7 @@ class TxIDMatcher:
             'verification_confidence': verification_result.get('confidence', 0.0),
             'issues': verification_result.get('issues', []),
             'transaction': verification_result.get('transaction_details'),
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': (now or datetime.now()).isoformat(),
             'recommendation': self._get_verification_recommendation(match_result, verification_result)
         }
     
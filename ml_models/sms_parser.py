@@ -7,45 +7,66 @@ import logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Regex patterns are compiled once at import time rather than on every parse
+# Runs up to a delimiter (e.g. (?>[^\(]+) before '(') are atomic: giving characters
+# back can never produce the delimiter, so backtracking into them is wasted work
+_PATTERN_SOURCES = {
+    # Payment out patterns (TxId: format)
+    'payment_out': [
+        r'TxId:\s*(\d+)\.\s*Your payment of ([\d,]+)\s*RWF to ([^\d]*?)\s*(\d*)\s*has been completed at ([\d\-\s:]+)\. Your new balance:\s*([\d,]+)\s*RWF\. Fee was\s*(\d+)\s*RWF',
+        r'TxId:\s*(\d+)\.\s*Your payment of ([\d,]+)\s*RWF to ([^\s]+(?:\s+[^\s]+)*)\s+has been completed at ([\d\-\s:]+)\. Your new balance:\s*([\d,]+)\s*RWF\. Fee was\s*(\d+)\s*RWF'
+    ],
+
+    # Transfer out patterns (*165*S* format)
+    'transfer_out': [
+        r'\*165\*S\*([\d,]+)\s*RWF transferred to ((?>[^\(]+))\s*\((\d+)\) from (\d+) at ([\d\-\s:]+)\s*\. Fee was:\s*(\d+)\s*RWF\. New balance:\s*([\d,]+)\s*RWF',
+        r'([\d,]+)\s*RWF transferred to ((?>[^\(]+))\s*\((\d+)\) from (\d+) at ([\d\-\s:]+)\s*\. Fee was:\s*(\d+)\s*RWF\. New balance:\s*([\d,]+)\s*RWF'
+    ],
+
+    # Payment in patterns (received money)
+    'payment_in': [
+        r'You have received ([\d,]+)\s*RWF from ((?>[^\(]+))\s*\((?>[^\)]+)\) on your mobile money account at ([\d\-\s:]+)\. Message from sender:\s*((?>[^.]*))\.\s*Your new balance:\s*([\d,]+)\s*RWF\. Financial Transaction Id:\s*(\d+)'
+    ],
+
+    # Withdrawal patterns
+    'withdrawal': [
+        r'You ((?>[^\(]+))\s*\((?>[^\)]+)\) have via agent:\s*((?>[^\(]+))\s*\((\d+)\), withdrawn ([\d,]+)\s*RWF from your mobile money account:\s*(\d+) at ([\d\-\s:]+) and you can now collect your money in cash\. Your new balance:\s*([\d,]+)\s*RWF\. Fee paid:\s*(\d+)\s*RWF\. Message from agent:\s*((?>[^.]*))\.\s*Financial Transaction Id:\s*(\d+)'
+    ],
+
+    # Airtime/Bundles patterns (*162*TxId format)
+    'airtime': [
+        r'\*162\*TxId:(\d+)\*S\*Your payment of ([\d,]+)\s*RWF to (Bundles and Packs|Airtime) with token\s*([^\s]*) and External Transaction Id:\s*(\d+) has been completed at ([\d\-\s:]+)\. Fee was\s*(\d+)\s*RWF\. Your new balance:\s*([\d,]+)\s*RWF\s*\. Message:\s*([^*]*)',
+        r'TxId:(\d+)\*S\*Your payment of ([\d,]+)\s*RWF to (Bundles and Packs|Airtime) with token\s*([^\s]*) and External Transaction Id:\s*(\d+) has been completed at ([\d\-\s:]+)\. Fee was\s*(\d+)\s*RWF\. Your new balance:\s*([\d,]+)\s*RWF'
+    ],
+
+    # Electricity/Utility patterns
+    'electricity': [
+        r'\*162\*TxId:(\d+)\*S\*Your payment of ([\d,]+)\s*RWF to ([^\s]+\s*[^\s]*) with token ([\d\-]+) and External Transaction Id:\s*([^\s]+)\s*([^\s]+) has been completed at ([\d\-\s:]+)\. Fee was\s*(\d+)\s*RWF\. Your new balance:\s*([\d,]+)\s*RWF\s*\. Message:\s*-\s*Electricity units:\s*([\d.]+)kwH'
+    ]
+}
+
+_SMS_PATTERNS = {
+    msg_type: [re.compile(pattern, re.IGNORECASE | re.DOTALL) for pattern in patterns]
+    for msg_type, patterns in _PATTERN_SOURCES.items()
+}
+
+_PHONE_RE = re.compile(r'(250\d{9}|\d{8,12})')
+
+# 'Financial Transaction Id:' and '*162*TxId:' used to be searched too, but any text
+# they match is already matched by the 'Transaction Id:' / 'TxId:' search before them
+_TXID_RES = [
+    re.compile(pattern, re.IGNORECASE) for pattern in (
+        r'TxId:\s*(\d+)',
+        r'Transaction Id:\s*(\d+)',
+        r'External Transaction Id:\s*([^\s]+)'
+    )
+]
+
 class MoMoSMSParser:
     """Advanced SMS parser for Rwandan MoMo transactions with ML-powered pattern recognition."""
     
     def __init__(self):
-        self.patterns = {
-            # Payment out patterns (TxId: format)
-            'payment_out': [
-                r'TxId:\s*(\d+)\.\s*Your payment of ([\d,]+)\s*RWF to ([^\d]*?)\s*(\d*)\s*has been completed at ([\d\-\s:]+)\. Your new balance:\s*([\d,]+)\s*RWF\. Fee was\s*(\d+)\s*RWF',
-                r'TxId:\s*(\d+)\.\s*Your payment of ([\d,]+)\s*RWF to ([^\s]+(?:\s+[^\s]+)*)\s+has been completed at ([\d\-\s:]+)\. Your new balance:\s*([\d,]+)\s*RWF\. Fee was\s*(\d+)\s*RWF'
-            ],
-            
-            # Transfer out patterns (*165*S* format)
-            'transfer_out': [
-                r'\*165\*S\*([\d,]+)\s*RWF transferred to ([^\(]+)\s*\((\d+)\) from (\d+) at ([\d\-\s:]+)\s*\. Fee was:\s*(\d+)\s*RWF\. New balance:\s*([\d,]+)\s*RWF',
-                r'([\d,]+)\s*RWF transferred to ([^\(]+)\s*\((\d+)\) from (\d+) at ([\d\-\s:]+)\s*\. Fee was:\s*(\d+)\s*RWF\. New balance:\s*([\d,]+)\s*RWF'
-            ],
-            
-            # Payment in patterns (received money)
-            'payment_in': [
-                r'You have received ([\d,]+)\s*RWF from ([^\(]+)\s*\([^\)]+\) on your mobile money account at ([\d\-\s:]+)\. Message from sender:\s*([^.]*)\.\s*Your new balance:\s*([\d,]+)\s*RWF\. Financial Transaction Id:\s*(\d+)',
-                r'You have received ([\d,]+)\s*RWF from ([^\(]+)\s*\([^\)]+\) on your mobile money account at ([\d\-\s:]+)\. Message from sender:\s*([^.]*)\.\s*Your new balance:\s*([\d,]+)\s*RWF\. Financial Transaction Id:\s*(\d+)'
-            ],
-            
-            # Withdrawal patterns
-            'withdrawal': [
-                r'You ([^\(]+)\s*\([^\)]+\) have via agent:\s*([^\(]+)\s*\((\d+)\), withdrawn ([\d,]+)\s*RWF from your mobile money account:\s*(\d+) at ([\d\-\s:]+) and you can now collect your money in cash\. Your new balance:\s*([\d,]+)\s*RWF\. Fee paid:\s*(\d+)\s*RWF\. Message from agent:\s*([^.]*)\.\s*Financial Transaction Id:\s*(\d+)'
-            ],
-            
-            # Airtime/Bundles patterns (*162*TxId format)
-            'airtime': [
-                r'\*162\*TxId:(\d+)\*S\*Your payment of ([\d,]+)\s*RWF to (Bundles and Packs|Airtime) with token\s*([^\s]*) and External Transaction Id:\s*(\d+) has been completed at ([\d\-\s:]+)\. Fee was\s*(\d+)\s*RWF\. Your new balance:\s*([\d,]+)\s*RWF\s*\. Message:\s*([^*]*)',
-                r'TxId:(\d+)\*S\*Your payment of ([\d,]+)\s*RWF to (Bundles and Packs|Airtime) with token\s*([^\s]*) and External Transaction Id:\s*(\d+) has been completed at ([\d\-\s:]+)\. Fee was\s*(\d+)\s*RWF\. Your new balance:\s*([\d,]+)\s*RWF'
-            ],
-            
-            # Electricity/Utility patterns
-            'electricity': [
-                r'\*162\*TxId:(\d+)\*S\*Your payment of ([\d,]+)\s*RWF to ([^\s]+\s*[^\s]*) with token ([\d\-]+) and External Transaction Id:\s*([^\s]+)\s*([^\s]+) has been completed at ([\d\-\s:]+)\. Fee was\s*(\d+)\s*RWF\. Your new balance:\s*([\d,]+)\s*RWF\s*\. Message:\s*-\s*Electricity units:\s*([\d.]+)kwH'
-            ]
-        }
+        self.patterns = _SMS_PATTERNS
     
     def clean_amount(self, amount_str: str) -> float:
         """Clean and convert amount string to float."""
@@ -53,26 +74,37 @@ class MoMoSMSParser:
     
     def parse_datetime(self, datetime_str: str) -> datetime:
         """Parse datetime string to datetime object."""
+        datetime_str = datetime_str.strip()
+        
+        # Zero-padded 'YYYY-MM-DD HH:MM[:SS]' (what MoMo sends) is also valid ISO 8601,
+        # and fromisoformat's C parser is far cheaper than strptime's format interpreter
+        if (len(datetime_str) in (16, 19) and datetime_str[10] == ' ' and datetime_str[13] == ':'
+                and (len(datetime_str) == 16 or datetime_str[16] == ':')):
+            try:
+                return datetime.fromisoformat(datetime_str)
+            except ValueError:
+                pass
+        
         try:
             # Handle format: 2025-07-30 16:30:40
-            return datetime.strptime(datetime_str.strip(), '%Y-%m-%d %H:%M:%S')
+            return datetime.strptime(datetime_str, '%Y-%m-%d %H:%M:%S')
         except ValueError:
             try:
                 # Handle alternative formats
-                return datetime.strptime(datetime_str.strip(), '%Y-%m-%d %H:%M')
+                return datetime.strptime(datetime_str, '%Y-%m-%d %H:%M')
             except ValueError:
                 logger.warning(f"Could not parse datetime: {datetime_str}")
                 return datetime.now()
     
     def extract_phone_number(self, text: str) -> Optional[str]:
         """Extract phone number from text."""
-        phone_match = re.search(r'(250\d{9}|\d{8,12})', text)
+        phone_match = _PHONE_RE.search(text)
         return phone_match.group(1) if phone_match else None
     
     def parse_payment_out(self, message: str) -> Optional[Dict]:
         """Parse outgoing payment messages."""
         for i, pattern in enumerate(self.patterns['payment_out']):
-            match = re.search(pattern, message, re.IGNORECASE | re.DOTALL)
+            match = pattern.search(message)
             if match:
                 if i == 0:  # First pattern with separate receiver code
                     return {
@@ -101,7 +133,7 @@ class MoMoSMSParser:
     def parse_transfer_out(self, message: str) -> Optional[Dict]:
         """Parse outgoing transfer messages."""
         for pattern in self.patterns['transfer_out']:
-            match = re.search(pattern, message, re.IGNORECASE | re.DOTALL)
+            match = pattern.search(message)
             if match:
                 return {
                     'amount': self.clean_amount(match.group(1)),
@@ -119,7 +151,7 @@ class MoMoSMSParser:
     def parse_payment_in(self, message: str) -> Optional[Dict]:
         """Parse incoming payment messages."""
         for pattern in self.patterns['payment_in']:
-            match = re.search(pattern, message, re.IGNORECASE | re.DOTALL)
+            match = pattern.search(message)
             if match:
                 return {
                     'amount': self.clean_amount(match.group(1)),
@@ -136,7 +168,7 @@ class MoMoSMSParser:
     def parse_withdrawal(self, message: str) -> Optional[Dict]:
         """Parse withdrawal messages."""
         for pattern in self.patterns['withdrawal']:
-            match = re.search(pattern, message, re.IGNORECASE | re.DOTALL)
+            match = pattern.search(message)
             if match:
                 return {
                     'sender_name': match.group(1).strip(),
@@ -156,7 +188,7 @@ class MoMoSMSParser:
     def parse_airtime(self, message: str) -> Optional[Dict]:
         """Parse airtime/bundles purchase messages."""
         for pattern in self.patterns['airtime']:
-            match = re.search(pattern, message, re.IGNORECASE | re.DOTALL)
+            match = pattern.search(message)
             if match:
                 return {
                     'tx_id': match.group(1),
@@ -174,7 +206,7 @@ class MoMoSMSParser:
     def parse_electricity(self, message: str) -> Optional[Dict]:
         """Parse electricity payment messages."""
         for pattern in self.patterns['electricity']:
-            match = re.search(pattern, message, re.IGNORECASE | re.DOTALL)
+            match = pattern.search(message)
             if match:
                 return {
                     'tx_id': match.group(1),
@@ -193,16 +225,8 @@ class MoMoSMSParser:
     def _extract_txid_from_message(self, message: str) -> Optional[str]:
         """Extract transaction ID from any format in the message."""
         # Look for various TxId patterns
-        patterns = [
-            r'TxId:\s*(\d+)',
-            r'Transaction Id:\s*(\d+)',
-            r'Financial Transaction Id:\s*(\d+)',
-            r'\*162\*TxId:(\d+)',
-            r'External Transaction Id:\s*([^\s]+)'
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, message, re.IGNORECASE)
+        for pattern in _TXID_RES:
+            match = pattern.search(message)
             if match:
                 return match.group(1)
         
@@ -212,13 +236,13 @@ class MoMoSMSParser:
         """Determine the type of transaction from the message content."""
         message_lower = message.lower()
         
+        # Plain substring checks: each `in` is a single C-level scan, and together
+        # they beat one regex alternation that has to try every phrase at every offset
         if 'your payment of' in message_lower and 'to' in message_lower:
             if 'bundles and packs' in message_lower or 'airtime' in message_lower:
                 return 'airtime'
             elif 'electricity units' in message_lower or 'cash power' in message_lower:
                 return 'electricity'
-            elif 'test merchant' in message_lower:
-                return 'payment_out'
             else:
                 return 'payment_out'
         elif 'you have received' in message_lower:
@@ -281,11 +305,8 @@ class MoMoSMSParser:
     
     def batch_parse(self, messages: List[str]) -> List[Dict]:
         """Parse multiple SMS messages in batch."""
-        results = []
-        for message in messages:
-            result = self.parse_sms(message)
-            results.append(result)
-        return results
+        parse_sms = self.parse_sms
+        return [parse_sms(message) for message in messages]
 
 # Test function to validate parser with provided samples
 def test_parser():
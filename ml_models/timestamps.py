@@ -0,0 +1,30 @@
+from datetime import datetime, timezone
+from typing import Optional, Union
+import logging
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+@lru_cache(maxsize=4096)
+def parse_timestamp(value: str) -> Optional[datetime]:
+    """Parse an ISO timestamp (Python 3.11 accepts a trailing 'Z'); memoized as rows share timestamps."""
+    # ISO dates always start with a four-digit year; reject anything else without raising
+    if value[:4].isdigit():
+        try:
+            return datetime.fromisoformat(value)
+        except ValueError:
+            pass
+    
+    # Failures are memoized too, so each malformed value is only logged once
+    logger.warning("Could not parse timestamp: %r", value)
+    return None
+
+def epoch_seconds(timestamp: Union[datetime, str, None]) -> Optional[float]:
+    """Convert a datetime or ISO string to epoch seconds, treating naive values as UTC."""
+    if isinstance(timestamp, str):
+        timestamp = parse_timestamp(timestamp)
+    if not isinstance(timestamp, datetime):
+        return None
+    if timestamp.tzinfo is None:
+        timestamp = timestamp.replace(tzinfo=timezone.utc)
+    return timestamp.timestamp()
@@ -3,9 +3,12 @@
 Complete system test for MoMo Payment Verification System
 """
 
+import io
 import os
 import sys
 import json
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 
 # Set environment variables for testing
@@ -98,6 +101,88 @@ def test_txid_matcher():
         print(f"❌ TxID Matcher: ERROR - {str(e)}")
         return False
 
+def test_batch_duplicates():
+    """Test duplicate TxID detection within one batch"""
+    print("🔁 Testing Batch Duplicate Detection...")
+    try:
+        from ml_models.fraud_detector import FraudDetector
+        
+        detector = FraudDetector()
+        transaction = {
+            'tx_id': '22004556853',
+            'amount': 1100.0,
+            'timestamp': datetime.now(),
+            'message_type': 'payment_out'
+        }
+        
+        # The second entry repeats the first one's TxID
+        results = detector.analyze_transactions([transaction, dict(transaction)], [])
+        first_types = [alert.alert_type for alert in results[0][1]]
+        second_types = [alert.alert_type for alert in results[1][1]]
+        
+        if 'duplicate_txid' not in first_types and 'duplicate_txid' in second_types:
+            print("✅ Batch Duplicate Detection: PASSED")
+            print(f"   - Second Entry Risk Score: {results[1][0]:.2f}")
+            return True
+        else:
+            print("❌ Batch Duplicate Detection: FAILED")
+            return False
+    except Exception as e:
+        print(f"❌ Batch Duplicate Detection: ERROR - {str(e)}")
+        return False
+
+def test_matcher_index():
+    """Test matching against an index extended after it was built"""
+    print("📇 Testing Matcher Index...")
+    try:
+        from ml_models.matcher import TxIDMatcher
+        
+        matcher = TxIDMatcher()
+        index = matcher.build_index([{
+            'tx_id': '22004556853',
+            'amount': 1100.0,
+            'timestamp': datetime.now()
+        }])
+        
+        # A row stored after the index was built must become matchable
+        matcher.add_to_index(index, {
+            'tx_id': '22004556854',
+            'amount': 2500.0,
+            'timestamp': datetime.now()
+        })
+        match_result = matcher.find_match('22004556854', index)
+        
+        if match_result.matched and match_result.transaction['tx_id'] == '22004556854':
+            print("✅ Matcher Index: PASSED")
+            print(f"   - Match Type: {match_result.match_type}")
+            return True
+        else:
+            print("❌ Matcher Index: FAILED")
+            return False
+    except Exception as e:
+        print(f"❌ Matcher Index: ERROR - {str(e)}")
+        return False
+
+def test_timestamps():
+    """Test that naive and UTC-suffixed timestamps agree"""
+    print("🕒 Testing Timestamps...")
+    try:
+        from ml_models.timestamps import epoch_seconds
+        
+        naive = epoch_seconds('2025-08-15T20:00:00')
+        utc = epoch_seconds('2025-08-15T20:00:00Z')
+        
+        if naive is not None and naive == utc:
+            print("✅ Timestamps: PASSED")
+            print(f"   - Epoch Seconds: {naive:.0f}")
+            return True
+        else:
+            print("❌ Timestamps: FAILED")
+            return False
+    except Exception as e:
+        print(f"❌ Timestamps: ERROR - {str(e)}")
+        return False
+
 def test_flask_app():
     """Test Flask application initialization"""
     print("🌐 Testing Flask Application...")
@@ -175,6 +260,17 @@ def test_configuration_files():
         print(f"❌ Configuration Files: ERROR - {str(e)}")
         return False
 
+def _run_test(test):
+    """Run a single test, capturing its output"""
+    buffer = io.StringIO()
+    with redirect_stdout(buffer):
+        try:
+            test_passed = bool(test())
+        except Exception as e:
+            print(f"❌ Test failed with exception: {str(e)}")
+            test_passed = False
+    return test_passed, buffer.getvalue()
+
 def main():
     """Run all tests"""
     print("🚀 MoMo Payment Verification System - Complete Test Suite")
@@ -184,6 +280,9 @@ def main():
         test_sms_parser,
         test_fraud_detector,
         test_txid_matcher,
+        test_batch_duplicates,
+        test_matcher_index,
+        test_timestamps,
         test_flask_app,
         test_database_schema,
         test_configuration_files
@@ -192,13 +291,15 @@ def main():
     passed = 0
     total = len(tests)
     
-    for test in tests:
-        try:
-            if test():
-                passed += 1
-        except Exception as e:
-            print(f"❌ Test failed with exception: {str(e)}")
-        print()
+    # Tests are independent, so run them in separate processes to overlap the
+    # module imports; output is collected per test and printed in order
+    with ProcessPoolExecutor(max_workers=min(total, os.cpu_count() or 1)) as executor:
+        results = list(executor.map(_run_test, tests))
+    
+    for test_passed, output in results:
+        print(output)
+        if test_passed:
+            passed += 1
     
     print("=" * 60)
     print(f"📊 Test Results: {passed}/{total} tests passed")